@@ -0,0 +1,146 @@
+#!/usr/bin/python
+
+"""
+Libraries for allocating subnets and addresses out of address pools.
+
+AddressPool is a buddy allocator: free space is kept as aligned blocks, one
+heap of free blocks per prefix length. An allocation splits the smallest
+free block that is big enough, and a release merges a block back with its
+buddy, so both take O(log n) time however many subnets are handed out.
+"""
+
+from ipaddress import ip_network, ip_interface
+import heapq
+
+class AddressPool(object):
+
+    """Hands out subnets of prefixLength (e.g. /30 or /31 for point-to-point
+    links, /127 for IPv6) out of one or more pools of the same IP version.
+    Subnets are carved out of the smallest free block that fits, lowest
+    address first, which keeps large blocks whole. Subnets of other sizes,
+    and specific subnets, can be allocated or reserved too."""
+
+    def __init__(self, pools, prefixLength=30):
+        self.pools = [ip_network(pool) for pool in pools]
+        self.prefixLength = prefixLength
+
+        versions = set(pool.version for pool in self.pools)
+        if len(versions) != 1:
+            raise Exception('Address pools must all be of the same IP version')
+        self.maxPrefixLength = self.pools[0].max_prefixlen
+        self.networkClass = type(self.pools[0])
+
+        # Free blocks as (address, prefix length). free is the source of
+        # truth and the heaps can hold stale entries, which are skipped.
+        self.free = set()
+        self.heaps = dict((length, []) for length in range(self.maxPrefixLength + 1))
+        for pool in self.pools:
+            self.addFree(int(pool.network_address), pool.prefixlen)
+        self.allocated = set()
+
+    def addFree(self, address, length):
+        self.free.add((address, length))
+        heapq.heappush(self.heaps[length], address)
+
+    def popFree(self, length):
+        """Takes the lowest free block of a prefix length, or returns None."""
+        heap = self.heaps[length]
+        while heap:
+            address = heapq.heappop(heap)
+            if (address, length) in self.free:
+                self.free.remove((address, length))
+                return address
+        return None
+
+    def blockSize(self, length):
+        return 1 << (self.maxPrefixLength - length)
+
+    def toNetwork(self, address, length):
+        return self.networkClass((address, length))
+
+    def parse(self, subnet):
+        if not isinstance(subnet, self.networkClass):
+            subnet = ip_network(subnet)
+        return subnet, int(subnet.network_address), subnet.prefixlen
+
+    def allocate(self, prefixLength=None):
+        """Allocates the lowest free subnet of prefixLength (by default the
+        pool's prefix length)."""
+        length = self.prefixLength if prefixLength is None else prefixLength
+
+        # Find the longest free prefix that can hold the subnet
+        for blockLength in range(length, -1, -1):
+            address = self.popFree(blockLength)
+            if address is not None:
+                break
+        else:
+            raise Exception('Address pool %s has no free /%s left'
+                            % (', '.join(str(pool) for pool in self.pools), length))
+
+        # Split it, freeing the upper halves
+        while blockLength < length:
+            blockLength += 1
+            self.addFree(address + self.blockSize(blockLength), blockLength)
+
+        self.allocated.add((address, length))
+        return self.toNetwork(address, length)
+
+    def reserve(self, subnet):
+        """Allocates a specific subnet, which must be free."""
+        subnet, address, length = self.parse(subnet)
+
+        # Find the free block that holds the subnet
+        for blockLength in range(length, -1, -1):
+            blockAddress = address & ~(self.blockSize(blockLength) - 1)
+            if (blockAddress, blockLength) in self.free:
+                break
+        else:
+            raise Exception('%s is not free in this address pool' % subnet)
+
+        # Split it down to the subnet, freeing the halves that don't hold it
+        self.free.remove((blockAddress, blockLength))
+        while blockLength < length:
+            blockLength += 1
+            half = self.blockSize(blockLength)
+            if address & half:
+                self.addFree(blockAddress, blockLength)
+                blockAddress += half
+            else:
+                self.addFree(blockAddress + half, blockLength)
+
+        self.allocated.add((address, length))
+        return subnet
+
+    def release(self, subnet):
+        """Returns an allocated or reserved subnet to the pool."""
+        subnet, address, length = self.parse(subnet)
+        if (address, length) not in self.allocated:
+            raise Exception('%s was not allocated from this address pool' % subnet)
+        self.allocated.remove((address, length))
+
+        # Merge with the buddy for as long as it is free too, but never
+        # beyond the pool it came from
+        poolLength = max(pool.prefixlen for pool in self.pools
+                         if address & ~(self.blockSize(pool.prefixlen) - 1) ==
+                         int(pool.network_address))
+        while length > poolLength:
+            buddy = (address ^ self.blockSize(length), length)
+            if buddy not in self.free:
+                break
+            self.free.remove(buddy)
+            address = min(address, buddy[0])
+            length -= 1
+        self.addFree(address, length)
+
+    def available(self):
+        """Returns the number of free addresses."""
+        return sum(self.blockSize(length) for _, length in self.free)
+
+    def allocatePair(self):
+        """Allocates a point-to-point subnet and returns the two interface
+        addresses on it. /31 and /127 subnets use both of their addresses,
+        larger ones the first two host addresses."""
+        subnet = self.allocate()
+        first = 0 if subnet.num_addresses == 2 else 1
+        return ip_interface(u'%s/%s' % (subnet[first], subnet.prefixlen)), \
+            ip_interface(u'%s/%s' % (subnet[first + 1], subnet.prefixlen))
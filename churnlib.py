@@ -0,0 +1,175 @@
+#!/usr/bin/python
+
+"""
+Libraries for generating BGP route churn from the external routers of a
+topology, to see how the routing apps behave under upstream route flaps.
+
+RouteChurn flaps prefixes of chosen BgpRouters at a given rate: every batch
+toggles the next few prefixes of one router, withdrawing them if they are
+announced and announcing them again if not. The batches go to bgpd's vty in
+the router's namespace, one shell round-trip per batch, and every change is
+recorded in a timeline.
+"""
+
+from mininet.log import info, debug, warn
+from routinglib import BgpProtocol
+from routelib import routePrefixes
+from threading import Thread, Event
+import itertools
+import time
+
+def bgpAsNum(router):
+    for p in router.protocols:
+        if isinstance(p, BgpProtocol):
+            return p.asNum
+    raise Exception('%s does not run BGP' % router.name)
+
+def applyBgpChanges(router, asNum, announce=[], withdraw=[]):
+    """Announces and withdraws network statements on a router's bgpd in one
+    vty session."""
+    commands = ['configure terminal', 'router bgp %s' % asNum]
+    commands += ['network %s' % prefix for prefix in announce]
+    commands += ['no network %s' % prefix for prefix in withdraw]
+    commands += ['end']
+    return router.vtyCmd(commands)
+
+def cyclePrefixes(source):
+    """Endlessly yields the prefixes of a route source. Unlike
+    itertools.cycle, the prefixes are generated anew on every pass instead
+    of being kept."""
+    while True:
+        empty = True
+        for prefix in routePrefixes(source):
+            empty = False
+            yield prefix
+        if empty:
+            return
+
+class RouteChurn(object):
+
+    """Flaps the prefixes of one or more BgpRouters. routes maps each router
+    to the route source whose prefixes it flaps, which would usually be
+    routes the router already advertises.
+
+    rate is the number of route changes per second, sent in batches of
+    burst changes. With onTime set, churn follows a square wave of onTime
+    seconds of changes followed by offTime quiet seconds. The run stops
+    after duration seconds. onChange, if given, is called with (router,
+    announced, withdrawn) after each batch, e.g. to tell an FpmReceiver which
+    routes to expect."""
+
+    def __init__(self, routes, rate=100, burst=10, duration=60,
+                 onTime=None, offTime=0, announced=True, onChange=None):
+        self.routes = routes
+        self.rate = float(rate)
+        self.burst = burst
+        self.duration = duration
+        self.onTime = onTime
+        self.offTime = offTime
+        self.onChange = onChange
+
+        self.asNums = dict((router, bgpAsNum(router)) for router in routes)
+        # Prefixes currently announced by each router, of those flapped
+        self.announced = dict((router, set(routePrefixes(source)) if announced else set())
+                              for router, source in routes.items())
+
+        # (time, router name, 'announce' or 'withdraw', prefix) of every change
+        self.timeline = []
+        # (start time, elapsed seconds, number of changes) of every batch
+        self.batches = []
+
+        self.stopEvent = Event()
+        self.thread = None
+
+    def nextBatches(self):
+        """Endlessly yields (router, prefixes) batches, taking turns between
+        the routers and cycling through each router's prefixes."""
+        cursors = dict((router, cyclePrefixes(source))
+                       for router, source in self.routes.items())
+        for router in itertools.cycle(sorted(self.routes, key=lambda r: r.name)):
+            yield router, list(itertools.islice(cursors[router], self.burst))
+
+    def churning(self, elapsed):
+        if self.onTime is None:
+            return True
+        return elapsed % (self.onTime + self.offTime) < self.onTime
+
+    def applyBatch(self, router, prefixes):
+        announced = self.announced[router]
+        announce = [prefix for prefix in prefixes if prefix not in announced]
+        withdraw = [prefix for prefix in prefixes if prefix in announced]
+
+        start = time.time()
+        applyBgpChanges(router, self.asNums[router], announce, withdraw)
+        elapsed = time.time() - start
+
+        announced.update(announce)
+        announced.difference_update(withdraw)
+        self.timeline.extend((start, router.name, 'announce', prefix) for prefix in announce)
+        self.timeline.extend((start, router.name, 'withdraw', prefix) for prefix in withdraw)
+        self.batches.append((start, elapsed, len(prefixes)))
+
+        if self.onChange is not None:
+            self.onChange(router, announce, withdraw)
+
+    def run(self):
+        """Generates churn until the duration is up or stop() is called."""
+        interval = self.burst / self.rate
+        start = time.time()
+        deadline = start
+        info('*** Churning %i routers at %.0f changes/s in batches of %i for %ss\n'
+             % (len(self.routes), self.rate, self.burst, self.duration))
+
+        batches = self.nextBatches()
+        while True:
+            now = time.time()
+            if now - start >= self.duration or self.stopEvent.is_set():
+                break
+
+            # Batches are scheduled on a fixed grid so that slow batches
+            # don't make the rate drift, and missed slots are skipped. The
+            # next batch is only taken once it is due, so none are skipped
+            # while the churn is off
+            if now > deadline + interval:
+                warn('*** Churn falling behind by %.3fs\n' % (now - deadline))
+                deadline = now
+            if deadline > now:
+                self.stopEvent.wait(deadline - now)
+            deadline += interval
+
+            if self.churning(time.time() - start):
+                router, prefixes = next(batches)
+                self.applyBatch(router, prefixes)
+
+        self.printSummary()
+
+    def start(self):
+        """Runs the churn in a background thread. Returns self."""
+        self.stopEvent.clear()
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def printSummary(self):
+        changes = sum(size for _, _, size in self.batches)
+        if not self.batches:
+            info('*** Churn made no changes\n')
+            return
+        duration = self.batches[-1][0] + self.batches[-1][1] - self.batches[0][0]
+        info('*** Churn made %i changes in %i batches over %.1fs (%.0f changes/s)\n'
+             % (changes, len(self.batches), duration, changes / duration if duration else 0))
+        debug('*** Slowest churn batch took %.3fs\n' % max(elapsed for _, elapsed, _ in self.batches))
+
+    def writeTimeline(self, filename):
+        """Writes the timeline out as CSV lines of time, router, action and
+        prefix."""
+        with open(filename, 'w') as f:
+            for change in self.timeline:
+                f.write('%.6f,%s,%s,%s\n' % change)
+        info('*** Wrote %i route changes to %s\n' % (len(self.timeline), filename))
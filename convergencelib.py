@@ -0,0 +1,227 @@
+#!/usr/bin/python
+
+"""
+Libraries for measuring how long routing takes to converge, at start-up and
+after failures.
+
+A ConvergenceMonitor repeatedly samples the BGP sessions and the number of
+routes zebra has installed on every QuaggaRouter, and pings between
+RoutedHosts behind different routers, until all three have converged:
+
+    net.start()
+    monitor = ConvergenceMonitor(net)
+    monitor.measure()
+    monitor.printReport()
+
+After a failure (e.g. the host command of RoutingCli, followed by its
+converge command) measure(requireFull=False) instead waits for the network
+to settle, as some sessions and hosts are then expected to stay down.
+"""
+
+from mininet.log import info, debug, warn
+from routinglib import QuaggaRouter, BgpProtocol, RoutedHost, RoutedHost6, setHostLinks
+from startuplib import runParallel
+import re
+import time
+
+# A neighbor row of a BGP summary, ending in the session state or, once
+# established, the number of prefixes received
+BGP_NEIGHBOR_ROW = re.compile(r'^([0-9a-fA-F.:]+)\s+4\s+\d+\s.*\s(\S+)\s*$')
+# A neighbor address too long for its column, which bgpd puts on a line of
+# its own with the rest of the row on the next line
+BGP_NEIGHBOR_ADDRESS = re.compile(r'^[0-9a-fA-F]*[.:][0-9a-fA-F.:]*$')
+
+def parseBgpSummary(output):
+    """Returns a dict of BGP neighbor address to True if the session is
+    established, from the output of BGP summaries."""
+    sessions = {}
+    address = None
+    for line in output.splitlines():
+        line = line.strip()
+        if address is not None:
+            line = '%s %s' % (address, line)
+            address = None
+        match = BGP_NEIGHBOR_ROW.match(line)
+        if match:
+            sessions[match.group(1)] = match.group(2).isdigit()
+        elif BGP_NEIGHBOR_ADDRESS.match(line):
+            address = line
+    return sessions
+
+def bgpSessions(router):
+    """Returns a dict of BGP neighbor address to True if the session is
+    established, as read from the router's bgpd. IPv6 sessions are only
+    listed in the IPv6 summary."""
+    return parseBgpSummary(router.vtyCmd(['show ip bgp summary',
+                                          'show bgp ipv6 unicast summary']))
+
+def installedRoutes(router):
+    """Returns the number of routes zebra has installed in the router's
+    kernel routing tables."""
+    output = router.cmd('ip -4 route show proto zebra | wc -l; ip -6 route show proto zebra | wc -l')
+    return sum(int(count) for count in output.split() if count.isdigit())
+
+def hostAddress(host):
+    return str(host.ips[0]).split('/')[0]
+
+class ConvergenceMonitor(object):
+
+    """Samples the routing state of a network every interval seconds.
+
+    The BGP sessions have converged when they are all established, the
+    routing table when every router has expectedRoutes routes installed (or,
+    without expectedRoutes, when the route counts have stopped changing) and
+    reachability when every probe succeeds. A probe is a ping from each
+    RoutedHost to the next one behind a different gateway. Each time is
+    taken from the first of stableSamples identical samples."""
+
+    def __init__(self, net, interval=0.5, timeout=120, expectedRoutes=None,
+                 stableSamples=3, maxWorkers=64):
+        self.net = net
+        self.interval = interval
+        self.timeout = timeout
+        self.expectedRoutes = expectedRoutes
+        self.stableSamples = stableSamples
+        self.maxWorkers = maxWorkers
+
+        self.routers = [host for host in net.hosts
+                        if isinstance(host, QuaggaRouter) and
+                        any(isinstance(p, BgpProtocol) for p in host.protocols)]
+        self.probes = self.pickProbes([host for host in net.hosts
+                                       if isinstance(host, (RoutedHost, RoutedHost6))])
+
+        # Dicts of the time, sessions up, sessions, route counts and probes ok
+        self.samples = []
+        self.start = None
+        self.times = {}
+
+    @staticmethod
+    def pickProbes(hosts):
+        """Pairs each host with the next one that has a different gateway,
+        i.e. that is behind another router."""
+        probes = []
+        for i, src in enumerate(hosts):
+            for dst in hosts[i + 1:] + hosts[:i]:
+                if dst.gateway != src.gateway:
+                    probes.append((src, dst))
+                    break
+        return probes
+
+    def sampleRouter(self, router):
+        if router.shell is None:
+            return {}, 0
+        return bgpSessions(router), installedRoutes(router)
+
+    def probe(self, pair):
+        src, dst = pair
+        ping = 'ping6' if isinstance(src, RoutedHost6) else 'ping'
+        output = src.cmd('%s -c 1 -W 1 %s' % (ping, hostAddress(dst)))
+        return ' 0% packet loss' in output
+
+    def sample(self):
+        """Takes one sample of all routers and probes in parallel."""
+        now = time.time()
+        routerResults = runParallel(self.sampleRouter, self.routers, self.maxWorkers)
+        probeResults = runParallel(self.probe, self.probes, self.maxWorkers)
+
+        sessions = [up for (routerSessions, _), _ in routerResults.values()
+                    for up in routerSessions.values()]
+        routeCounts = dict((router.name, result[0][1]) for router, result in routerResults.items())
+        probesOk = len([ok for ok, _ in probeResults.values() if ok])
+
+        sample = {'time': now,
+                  'sessionsUp': len([up for up in sessions if up]),
+                  'sessions': len(sessions),
+                  'routeCounts': routeCounts,
+                  'probesOk': probesOk}
+        self.samples.append(sample)
+        debug('*** %.1fs: %i/%i sessions, %i routes, %i/%i probes\n'
+              % (now - self.start, sample['sessionsUp'], sample['sessions'],
+                 sum(routeCounts.values()), probesOk, len(self.probes)))
+        return sample
+
+    def settledSince(self, key, full):
+        """Returns the time of the first of the last stableSamples samples if
+        they all agree on key and, where full is given, satisfy it."""
+        window = self.samples[-self.stableSamples:]
+        if len(window) < self.stableSamples:
+            return None
+        if any(sample[key] != window[0][key] for sample in window):
+            return None
+        if full is not None and not full(window[0]):
+            return None
+        return window[0]['time']
+
+    def measure(self, start=None, requireFull=True):
+        """Samples until sessions, routes and reachability have all converged
+        or the timeout expires. Times are measured from start, which defaults
+        to now. Returns a dict of the time each milestone was reached, in
+        seconds after start, with None for the ones never reached."""
+        self.start = time.time() if start is None else start
+        self.samples = []
+        self.times = dict((milestone, None) for milestone in
+                          ['firstSession', 'allSessions', 'fullTable', 'fullReachability'])
+
+        if requireFull:
+            sessionsFull = lambda s: s['sessions'] > 0 and s['sessionsUp'] == s['sessions']
+            if self.expectedRoutes is not None:
+                tableFull = lambda s: all(count >= self.expectedRoutes
+                                          for count in s['routeCounts'].values())
+            else:
+                tableFull = lambda s: sum(s['routeCounts'].values()) > 0
+            reachabilityFull = lambda s: s['probesOk'] == len(self.probes)
+        else:
+            sessionsFull = tableFull = reachabilityFull = None
+
+        milestones = [('allSessions', 'sessionsUp', sessionsFull),
+                      ('fullTable', 'routeCounts', tableFull),
+                      ('fullReachability', 'probesOk', reachabilityFull)]
+
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            sampleStart = time.time()
+            sample = self.sample()
+
+            if self.times['firstSession'] is None and sample['sessionsUp'] > 0:
+                self.times['firstSession'] = sample['time'] - self.start
+            for milestone, key, full in milestones:
+                if self.times[milestone] is None:
+                    settled = self.settledSince(key, full)
+                    if settled is not None:
+                        self.times[milestone] = settled - self.start
+                        info('*** %s after %.2fs\n' % (milestone, self.times[milestone]))
+
+            if all(self.times[milestone] is not None for milestone, _, _ in milestones):
+                break
+            time.sleep(max(self.interval - (time.time() - sampleStart), 0))
+        else:
+            warn('*** Routing did not converge within %ss\n' % self.timeout)
+
+        return self.times
+
+    def printReport(self):
+        info('*** Convergence, measured from %s:\n'
+             % time.strftime('%H:%M:%S', time.localtime(self.start)))
+        for milestone in ['firstSession', 'allSessions', 'fullTable', 'fullReachability']:
+            elapsed = self.times.get(milestone)
+            if elapsed is None:
+                info('%18s: not reached\n' % milestone)
+            else:
+                info('%18s: %7.2fs (at %s)\n'
+                     % (milestone, elapsed,
+                        time.strftime('%H:%M:%S', time.localtime(self.start + elapsed))))
+        if self.samples:
+            last = self.samples[-1]
+            info('%18s: %i/%i sessions up, %i routes, %i/%i probes ok\n'
+                 % ('final state', last['sessionsUp'], last['sessions'],
+                    sum(last['routeCounts'].values()), last['probesOk'], len(self.probes)))
+
+def measureReconvergence(net, hostName, op, **kwargs):
+    """Brings a host up or down, as the host command of RoutingCli does, and
+    measures how long routing takes to settle afterwards."""
+    monitor = ConvergenceMonitor(net, **kwargs)
+    start = time.time()
+    setHostLinks(net.get(hostName), op)
+    monitor.measure(start=start, requireFull=False)
+    monitor.printReport()
+    return monitor.times
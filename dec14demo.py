@@ -3,10 +3,12 @@
 from mininet.topo import Topo
 from mininet.node import RemoteController, OVSSwitch, OVSBridge
 from mininet.log import setLogLevel, info
-from mininet.net import Mininet
+from startuplib import ParallelMininet as Mininet
 from routinglib import RoutingCli as CLI
 from routinglib import AutonomousSystem, BasicAutonomousSystem, SdnAutonomousSystem
-from routinglib import generateRoutes
+from routinglib import generateRoutes, waitForRouters
+from convergencelib import ConvergenceMonitor
+import argparse
 
 onoses = [ '192.168.56.11', '192.168.56.12', '192.168.56.13' ]
 
@@ -98,7 +100,7 @@ class Dec14DemoTopo( Topo ):
         sdnAs.build(self, coreMesh[0], cs0)
         # TODO multihome the BGP speakers to different switches
 
-def run():
+def run( converge=False ):
     topo = Dec14DemoTopo( )
     net = Mininet( topo=topo, switch=OVSSwitch, controller=None )
 
@@ -107,13 +109,26 @@ def run():
 
     net.start()
 
+    waitForRouters( net.hosts )
+
+    # Otherwise the converge command of the CLI measures it on demand
+    if converge:
+        monitor = ConvergenceMonitor( net )
+        monitor.measure()
+        monitor.printReport()
+
     CLI( net )
 
     net.stop()
     info( 'done\n' )
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='Dec 14 SDN-IP demo topology' )
+    parser.add_argument( '--converge', action='store_true',
+                         help='measure how long routing takes to converge before starting the CLI' )
+    args = parser.parse_args()
+
     setLogLevel( 'debug' )
-    run()
+    run( args.converge )
 
 
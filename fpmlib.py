@@ -0,0 +1,248 @@
+#!/usr/bin/python
+
+"""
+A stand-in for the FPM (Forwarding Plane Manager) receiver that ONOS runs,
+for benchmarking how fast zebra programs routes without a live controller.
+
+Point zebra's FPM connection (the fpm= argument of QuaggaRouter) at a
+FpmReceiver, which decodes the netlink-framed FPM messages, counts route
+adds and deletes and reports the rate, batch sizes and the latency from
+when a route was announced (see expectRoutes) to when zebra sent it.
+
+It can run in the root namespace, started from a topology script:
+
+    receiver = FpmReceiver().start()
+    ...
+    receiver.printReport()
+
+or in a Mininet host as a standalone program:
+
+    host.popen('python fpmlib.py --port 2620 --interval 5')
+"""
+
+from mininet.log import info, debug, setLogLevel
+from startuplib import percentile
+from threading import Thread, Lock
+import SocketServer
+import argparse
+import socket
+import struct
+import time
+
+FPM_HEADER = struct.Struct('!BBH')
+FPM_VERSION = 1
+FPM_MSG_TYPE_NETLINK = 1
+
+# Netlink messages come in the host byte order of the sender
+NLMSG_HEADER = struct.Struct('=IHHII')
+RTMSG = struct.Struct('=BBBBBBBBI')
+RTATTR_HEADER = struct.Struct('=HH')
+
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+
+def align(length):
+    return (length + 3) & ~3
+
+def decodeRoute(data):
+    """Decodes the rtmsg payload of an RTM_NEWROUTE/RTM_DELROUTE message into
+    a dict with the prefix, and the gateway and output interface if any."""
+    family, dstLen = RTMSG.unpack_from(data)[:2]
+    dst = '0.0.0.0' if family == socket.AF_INET else '::'
+    route = {}
+
+    offset = RTMSG.size
+    while offset + RTATTR_HEADER.size <= len(data):
+        attrLen, attrType = RTATTR_HEADER.unpack_from(data, offset)
+        if attrLen < RTATTR_HEADER.size:
+            break
+        value = data[offset + RTATTR_HEADER.size:offset + attrLen]
+        if attrType == RTA_DST:
+            dst = socket.inet_ntop(family, value)
+        elif attrType == RTA_GATEWAY:
+            route['gateway'] = socket.inet_ntop(family, value)
+        elif attrType == RTA_OIF:
+            route['oif'] = struct.unpack('=I', value)[0]
+        offset += align(attrLen)
+
+    route['prefix'] = '%s/%s' % (dst, dstLen)
+    return route
+
+def decodeNetlink(data):
+    """Yields (message type, route) for each route message in a buffer of
+    netlink messages."""
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        msgLen, msgType = NLMSG_HEADER.unpack_from(data, offset)[:2]
+        if msgLen < NLMSG_HEADER.size:
+            break
+        if msgType in (RTM_NEWROUTE, RTM_DELROUTE):
+            yield msgType, decodeRoute(data[offset + NLMSG_HEADER.size:offset + msgLen])
+        offset += align(msgLen)
+
+def readFpmMessages(sock):
+    """Yields the netlink payload of every FPM message read from sock until
+    the connection is closed."""
+    buf = ''
+    while True:
+        chunk = sock.recv(1 << 16)
+        if not chunk:
+            return
+        buf += chunk
+        offset = 0
+        while offset + FPM_HEADER.size <= len(buf):
+            version, msgType, msgLen = FPM_HEADER.unpack_from(buf, offset)
+            if msgLen < FPM_HEADER.size:
+                raise Exception('Bad FPM message length %s' % msgLen)
+            if offset + msgLen > len(buf):
+                break
+            if version == FPM_VERSION and msgType == FPM_MSG_TYPE_NETLINK:
+                yield buf[offset + FPM_HEADER.size:offset + msgLen]
+            offset += msgLen
+        buf = buf[offset:]
+
+class FpmStats(object):
+
+    """Counts the route updates received over FPM. Updates that arrive less
+    than batchGap seconds apart are counted as one batch."""
+
+    def __init__(self, batchGap=0.01):
+        self.batchGap = batchGap
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self.adds = 0
+        self.dels = 0
+        self.firstTime = None
+        self.lastTime = None
+        self.batchSizes = []
+        self.currentBatch = 0
+        self.announceTimes = {}
+        self.latencies = []
+
+    def record(self, msgType, route, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.firstTime is None:
+                self.firstTime = now
+            elif now - self.lastTime > self.batchGap:
+                self.batchSizes.append(self.currentBatch)
+                self.currentBatch = 0
+            self.lastTime = now
+            self.currentBatch += 1
+
+            if msgType == RTM_NEWROUTE:
+                self.adds += 1
+                announced = self.announceTimes.pop(route['prefix'], None)
+                if announced is not None:
+                    self.latencies.append(now - announced)
+            else:
+                self.dels += 1
+
+    def expectRoutes(self, prefixes, announced=None):
+        """Records when routes were announced, so that the latency until they
+        come out of FPM can be measured."""
+        announced = time.time() if announced is None else announced
+        with self.lock:
+            for prefix in prefixes:
+                self.announceTimes[str(prefix)] = announced
+
+    def report(self):
+        """Returns a dict summarizing what was received so far."""
+        with self.lock:
+            batches = self.batchSizes + ([self.currentBatch] if self.currentBatch else [])
+            updates = self.adds + self.dels
+            duration = (self.lastTime - self.firstTime) if updates else 0
+            return {'adds': self.adds,
+                    'dels': self.dels,
+                    'duration': duration,
+                    'rate': updates / duration if duration > 0 else None,
+                    'batches': len(batches),
+                    'meanBatch': float(sum(batches)) / len(batches) if batches else None,
+                    'maxBatch': max(batches) if batches else None,
+                    'p50Latency': percentile(self.latencies, 50),
+                    'p99Latency': percentile(self.latencies, 99),
+                    'pending': len(self.announceTimes)}
+
+    def printReport(self):
+        r = self.report()
+        info('*** FPM: %i adds, %i dels in %.3fs' % (r['adds'], r['dels'], r['duration']))
+        if r['rate'] is not None:
+            info(' (%.0f routes/s)' % r['rate'])
+        info('\n')
+        if r['batches']:
+            info('*** FPM: %i batches, mean size %.1f, max %i\n'
+                 % (r['batches'], r['meanBatch'], r['maxBatch']))
+        if r['p50Latency'] is not None:
+            info('*** FPM: announce-to-FPM latency p50 %.3fs, p99 %.3fs, %i routes pending\n'
+                 % (r['p50Latency'], r['p99Latency'], r['pending']))
+
+class FpmHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        stats = self.server.stats
+        debug('*** FPM connection from %s:%s\n' % self.client_address)
+        for payload in readFpmMessages(self.request):
+            for msgType, route in decodeNetlink(payload):
+                stats.record(msgType, route)
+        debug('*** FPM connection from %s:%s closed\n' % self.client_address)
+
+class FpmReceiver(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+
+    """Accepts FPM connections from any number of zebras, each handled by its
+    own thread, and gathers their route updates in stats."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address='0.0.0.0', port=2620, batchGap=0.01):
+        SocketServer.TCPServer.__init__(self, (address, port), FpmHandler)
+        self.stats = FpmStats(batchGap)
+        self.thread = None
+
+    def start(self):
+        """Serves in a background thread. Returns self."""
+        self.thread = Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        info('*** FPM receiver listening on %s:%s\n' % self.server_address)
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def expectRoutes(self, prefixes, announced=None):
+        self.stats.expectRoutes(prefixes, announced)
+
+    def printReport(self):
+        self.stats.printReport()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='FPM receiver for benchmarking zebra')
+    parser.add_argument('--address', default='0.0.0.0', help='address to listen on')
+    parser.add_argument('--port', type=int, default=2620, help='port to listen on')
+    parser.add_argument('--interval', type=float, default=5,
+                        help='seconds between reports')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='seconds to run for (default: until interrupted)')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    setLogLevel('info')
+    args = parse_args()
+    receiver = FpmReceiver(args.address, args.port).start()
+    start = time.time()
+    try:
+        while args.duration is None or time.time() - start < args.duration:
+            time.sleep(args.interval)
+            receiver.printReport()
+    except KeyboardInterrupt:
+        pass
+    receiver.printReport()
+    receiver.stop()
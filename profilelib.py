@@ -0,0 +1,284 @@
+#!/usr/bin/python
+
+"""
+Libraries for profiling where the start-up and teardown time of a topology
+goes. When enabled, every config()/terminate() of the routinglib and
+trellislib node classes, every cmd() they issue and every daemon launch is
+timed. The timeline is written as a trace-event JSON file that can be opened
+in chrome://tracing or Perfetto, with one track per node.
+
+Profiling is off by default and costs nothing then, as the methods are only
+wrapped while it is enabled.
+
+dryRun() instead sends every cmd() of a topology's hosts to a recorder, which
+shows exactly which commands start-up runs without needing root, a shell or
+network namespaces.
+"""
+
+from mininet.node import Node
+from mininet.nodelib import NAT
+from mininet.link import Intf
+from mininet.log import info
+from functools import wraps
+from threading import Lock
+import atexit
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+# Modules whose node classes get their config()/terminate() instrumented
+INSTRUMENTED_MODULES = ('routinglib', 'trellislib')
+
+class Profiler(object):
+
+    """Collects timed spans and writes them out as trace events."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.events = []
+        self.tids = {}
+        self.lock = Lock()
+
+    def tid(self, nodeName):
+        with self.lock:
+            if nodeName not in self.tids:
+                self.tids[nodeName] = len(self.tids) + 1
+            return self.tids[nodeName]
+
+    def record(self, nodeName, category, name, start, end, args=None):
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': 1,
+                 'tid': self.tid(nodeName),
+                 'ts': int((start - self.start) * 1e6),
+                 'dur': int((end - start) * 1e6)}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def writeTrace(self, filename):
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+                     'args': {'name': nodeName}}
+                    for nodeName, tid in self.tids.items()]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': metadata + self.events}, f)
+        info('*** Wrote %i trace events to %s\n' % (len(self.events), filename))
+
+    def printSummary(self, topN=10):
+        nodeNames = dict((tid, nodeName) for nodeName, tid in self.tids.items())
+
+        configTimes = {}
+        for event in self.events:
+            if event['cat'] == 'config':
+                nodeName = nodeNames[event['tid']]
+                configTimes[nodeName] = max(configTimes.get(nodeName, 0), event['dur'])
+        info('*** Slowest nodes to configure:\n')
+        for nodeName, dur in sorted(configTimes.items(), key=lambda n: -n[1])[:topN]:
+            info('%10.3fs  %s\n' % (dur / 1e6, nodeName))
+
+        commands = [event for event in self.events if event['cat'] in ('cmd', 'daemon')]
+        info('*** Slowest commands:\n')
+        for event in sorted(commands, key=lambda e: -e['dur'])[:topN]:
+            info('%10.3fs  %-10s %s\n' % (event['dur'] / 1e6, nodeNames[event['tid']],
+                                          event['args']['cmd'][:80]))
+
+profiler = None
+originals = []
+
+def instrument(p, cls, method, category, nameFunc):
+    """Wraps a method defined by cls so that each call is recorded by p."""
+    original = cls.__dict__[method]
+
+    @wraps(original)
+    def wrapper(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            name, spanArgs = nameFunc(self, args)
+            p.record(self.name, category, name, start, time.time(), spanArgs)
+
+    setattr(cls, method, wrapper)
+    originals.append((cls, method, original))
+
+def cmdName(node, args):
+    cmd = ' '.join(str(arg) for arg in args)
+    verb = os.path.basename(cmd.split()[0]) if cmd.strip() else ''
+    return verb, {'cmd': cmd}
+
+def cmdVerbs(cmd):
+    """Returns the name of every command of a command line, taking commands
+    chained with ;, && or || apart and looking past env, exec, sh -c and
+    redirections."""
+    verbs = []
+    for part in re.split(r';|&&|\|\|', cmd):
+        words = [word for word in (w.lstrip('\'"(') for w in part.split()) if word]
+        while words:
+            if words[0] in ('env', 'exec', 'nohup') or re.match(r'\w+=|\d*[<>]', words[0]):
+                del words[:1]
+            elif os.path.basename(words[0]) in ('sh', 'bash') and words[1:2] == ['-c']:
+                del words[:2]
+            else:
+                break
+        if words:
+            verbs.append(os.path.basename(words[0]))
+    return verbs
+
+def methodName(cls, method):
+    return lambda node, args: ('%s.%s' % (cls.__name__, method), None)
+
+def daemonName(node, args):
+    return args[0], {'cmd': args[2]}
+
+def nodeClasses(cls=Node):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        for c in nodeClasses(subclass):
+            yield c
+
+def enableProfiling(traceFile=None):
+    """Starts profiling. If traceFile is given, the trace is written there
+    and a summary is printed when the program exits."""
+    global profiler
+    if profiler is not None:
+        return profiler
+    profiler = Profiler()
+
+    instrument(profiler, Node, 'cmd', 'cmd', cmdName)
+    for cls in set(nodeClasses()):
+        if cls.__module__ not in INSTRUMENTED_MODULES:
+            continue
+        for method in ['config', 'terminate']:
+            if method in cls.__dict__:
+                instrument(profiler, cls, method, method, methodName(cls, method))
+        if 'startDaemon' in cls.__dict__:
+            instrument(profiler, cls, 'startDaemon', 'daemon', daemonName)
+
+    if traceFile is not None:
+        def writeOut(p=profiler):
+            p.writeTrace(traceFile)
+            p.printSummary()
+        atexit.register(writeOut)
+
+    return profiler
+
+def disableProfiling():
+    """Stops profiling and returns the profiler holding what was recorded."""
+    global profiler
+    while originals:
+        cls, method, original = originals.pop()
+        setattr(cls, method, original)
+    p, profiler = profiler, None
+    return p
+
+class CommandRecorder(object):
+
+    """Records the command stream of each node instead of running it."""
+
+    # Canned output for commands whose output is polled, so that waits for
+    # DAD or leases finish at once
+    addrOutput = ('inet 192.0.2.1/24 scope global\n'
+                  'inet6 fe80::1/64 scope link\n'
+                  'inet6 2001:db8::1/128 scope global\n')
+
+    def __init__(self):
+        self.commands = {}
+        self.classes = {}
+
+    def record(self, node, *args):
+        if len(args) == 1 and isinstance(args[0], list):
+            args = args[0]
+        cmd = ' '.join(str(arg) for arg in args)
+        self.classes[node.name] = node.__class__.__name__
+        self.commands.setdefault(node.name, []).append(cmd)
+        return self.addrOutput if 'addr show' in cmd else ''
+
+    def countsByClass(self):
+        counts = {}
+        for nodeName, cmds in self.commands.items():
+            cls = self.classes[nodeName]
+            counts[cls] = counts.get(cls, 0) + len(cmds)
+        return counts
+
+    def countsByVerb(self):
+        counts = {}
+        for cmds in self.commands.values():
+            for cmd in cmds:
+                for verb in cmdVerbs(cmd):
+                    counts[verb] = counts.get(verb, 0) + 1
+        return counts
+
+    def totalCommands(self):
+        return sum(len(cmds) for cmds in self.commands.values())
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            for nodeName in sorted(self.commands):
+                f.write('# %s (%s)\n' % (nodeName, self.classes[nodeName]))
+                for cmd in self.commands[nodeName]:
+                    f.write('%s\n' % cmd)
+
+    def printSummary(self):
+        info('*** %i commands on %i nodes\n' % (self.totalCommands(), len(self.commands)))
+        info('*** Commands per class:\n')
+        for cls, count in sorted(self.countsByClass().items(), key=lambda c: -c[1]):
+            info('%8i  %s\n' % (count, cls))
+        info('*** Commands per verb:\n')
+        for verb, count in sorted(self.countsByVerb().items(), key=lambda c: -c[1]):
+            info('%8i  %s\n' % (count, verb))
+
+def dryRun(topo):
+    """Configures every host of topo, in configStage order, with all of
+    their cmd() calls sent to a CommandRecorder, which is returned. Nodes
+    get no shell or namespace and Mininet's executables aren't needed.
+    Daemons are never started and count as ready at once, and the files
+    the node classes write go to a temporary directory. Mininet's NAT edits
+    /etc/network/interfaces, so NATs only record their interface setup."""
+    # Imported here as these modules build on this one
+    import routinglib
+    from startuplib import configStage, configHost, prepareHosts, processes
+
+    recorder = CommandRecorder()
+    tmpDir = tempfile.mkdtemp(prefix='dryrun-')
+    patches = [(Node, 'checkSetup', classmethod(lambda cls: None)),
+               (Node, 'startShell', lambda self, *args, **kwargs: None),
+               (NAT, 'config', lambda self, **params: Node.config(self, **params)),
+               (Node, 'cmd', lambda self, *args, **kwargs: recorder.record(self, *args)),
+               (routinglib.QuaggaRouter, 'daemonReady', lambda self, daemon: True),
+               (routinglib.QuaggaRouter, 'logDir', tmpDir),
+               (routinglib.Router, 'batchDir', tmpDir),
+               (processes, 'register', lambda pidFile: None)]
+    saved = [(obj, attr, obj.__dict__.get(attr)) for obj, attr, _ in patches]
+    for obj, attr, value in patches:
+        setattr(obj, attr, value)
+
+    try:
+        hosts = []
+        for hostName in topo.hosts():
+            params = dict(topo.nodeInfo(hostName), inNamespace=False)
+            cls = params.pop('cls', Node)
+            if issubclass(cls, routinglib.QuaggaRouter):
+                params.setdefault('runDir', tmpDir)
+            hosts.append(cls(hostName, **params))
+
+        nodes = dict((host.name, host) for host in hosts)
+        for src, dst, linkInfo in topo.links(sort=True, withInfo=True):
+            for nodeName, port in [(src, linkInfo['port1']), (dst, linkInfo['port2'])]:
+                if nodeName in nodes:
+                    Intf('%s-eth%s' % (nodeName, port), node=nodes[nodeName], port=port)
+
+        start = time.time()
+        prepareHosts(hosts)
+        for host in sorted(hosts, key=configStage):
+            configHost(host)
+        info('*** Dry run configured %i hosts in %.3fs\n' % (len(hosts), time.time() - start))
+    finally:
+        for obj, attr, value in saved:
+            if value is None:
+                delattr(obj, attr)
+            else:
+                setattr(obj, attr, value)
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+    return recorder
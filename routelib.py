@@ -0,0 +1,215 @@
+#!/usr/bin/python
+
+"""
+Libraries for planning and describing large sets of routes without building
+them in memory.
+
+A route source is anything iterable that yields prefixes. RouteRange and
+RouteChain are lazy, sliceable sequences of ip_network objects that can be
+advertised by a BGP router, and routePrefixes() turns any route source into
+a stream of prefix strings that can be written straight into a bgpd config.
+
+generateRoutes() plans a set of routes out of a base range, either all of
+one prefix length or following a mix of prefix lengths such as DFZ_MIX.
+"""
+
+from ipaddress import ip_network
+from bisect import bisect_right
+import socket
+import struct
+
+# Rough share of each prefix length in the IPv4 default-free zone, which is
+# dominated by /24s
+DFZ_MIX = {24: 60, 23: 10, 22: 12, 21: 5, 20: 5, 19: 4, 18: 2, 17: 1, 16: 1}
+
+class RouteRange(object):
+
+    """numRoutes consecutive prefixes of length prefixLength carved out of
+    baseRange, e.g. RouteRange(u'100.0.0.0/8', 100000, 24), starting offset
+    prefixes into baseRange. The prefixes are only worked out when they are
+    accessed, so a range of any size takes no memory. Indexing gives an
+    ip_network and slicing gives another RouteRange."""
+
+    def __init__(self, baseRange, numRoutes, prefixLength, offset=0):
+        self.baseNetwork = ip_network(baseRange)
+        self.prefixLength = prefixLength
+        self.numRoutes = numRoutes
+        self.offset = offset
+
+        if prefixLength < self.baseNetwork.prefixlen or \
+                prefixLength > self.baseNetwork.max_prefixlen:
+            raise Exception('Bad prefix length /%s for %s' % (prefixLength, baseRange))
+        if offset + numRoutes > 2 ** (prefixLength - self.baseNetwork.prefixlen):
+            raise Exception("Can't fit %s /%s routes in %s" % (numRoutes, prefixLength, baseRange))
+
+        self.step = 1 << (self.baseNetwork.max_prefixlen - prefixLength)
+        self.start = int(self.baseNetwork.network_address) + offset * self.step
+
+    def __len__(self):
+        return self.numRoutes
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, stride = index.indices(self.numRoutes)
+            if stride != 1:
+                return [self[i] for i in xrange(start, stop, stride)]
+            return RouteRange(self.baseNetwork, max(stop - start, 0),
+                              self.prefixLength, self.offset + start)
+
+        if index < 0:
+            index += self.numRoutes
+        if not 0 <= index < self.numRoutes:
+            raise IndexError('route index out of range')
+        address = type(self.baseNetwork.network_address)(self.start + index * self.step)
+        return ip_network(u'%s/%s' % (address, self.prefixLength))
+
+    def __iter__(self):
+        for prefix in self.prefixes():
+            yield ip_network(unicode(prefix))
+
+    def prefixes(self):
+        """Yields the routes as prefix strings, which is much faster than
+        creating an ip_network object for each of them."""
+        start, step = self.start, self.step
+        suffix = '/%s' % self.prefixLength
+
+        if self.baseNetwork.version == 4:
+            pack = struct.Struct('!I').pack
+            for i in xrange(self.numRoutes):
+                yield socket.inet_ntoa(pack(start + i * step)) + suffix
+        else:
+            for i in xrange(self.numRoutes):
+                address = start + i * step
+                packed = struct.pack('!QQ', address >> 64, address & (2 ** 64 - 1))
+                yield socket.inet_ntop(socket.AF_INET6, packed) + suffix
+
+    def __repr__(self):
+        return 'RouteRange(%r, %s, %s, %s)' % (str(self.baseNetwork), self.numRoutes,
+                                               self.prefixLength, self.offset)
+
+class RouteChain(object):
+
+    """Route source made of several route sources one after the other. If
+    all the sources are sequences, so is the chain."""
+
+    def __init__(self, *sources):
+        self.sources = sources
+        self.ends = []
+
+    def lengths(self):
+        if not self.ends:
+            total = 0
+            for source in self.sources:
+                total += len(source)
+                self.ends.append(total)
+        return self.ends
+
+    def __len__(self):
+        ends = self.lengths()
+        return ends[-1] if ends else 0
+
+    def __getitem__(self, index):
+        ends = self.lengths()
+        if isinstance(index, slice):
+            start, stop, stride = index.indices(len(self))
+            if stride != 1:
+                return [self[i] for i in xrange(start, stop, stride)]
+            sources = []
+            for source, end in zip(self.sources, ends):
+                begin = end - len(source)
+                if begin < stop and end > start:
+                    sources.append(source[max(start - begin, 0):min(stop, end) - begin])
+            return RouteChain(*sources)
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('route index out of range')
+        i = bisect_right(ends, index)
+        return self.sources[i][index - (ends[i] - len(self.sources[i]))]
+
+    def __iter__(self):
+        for source in self.sources:
+            for route in source:
+                yield route
+
+    def prefixes(self):
+        for source in self.sources:
+            for prefix in routePrefixes(source):
+                yield prefix
+
+    def __repr__(self):
+        return 'RouteChain(%s)' % ', '.join(repr(source) for source in self.sources)
+
+def routePrefixes(routes):
+    """Yields the routes of any route source as prefix strings. Lists and
+    generators of prefix strings or ip_network objects work too."""
+    if hasattr(routes, 'prefixes'):
+        return routes.prefixes()
+    return (str(route) for route in routes)
+
+def isLazy(routes):
+    """Checks whether a route source is generated on the fly rather than
+    held in a list."""
+    return not isinstance(routes, (list, tuple))
+
+def planPrefixLength(baseNetwork, numRoutes):
+    """Returns the shortest prefix length that splits baseNetwork into at
+    least numRoutes subnets (and at least 2). It is capped at /30 (/126 for
+    IPv6), which leaves each subnet 2 usable addresses; past that there
+    aren't enough routes."""
+    # We need to get at least 2 addresses out of each subnet, so the biggest
+    # prefix length we can have is /30 (or /126)
+    maxPrefixLength = baseNetwork.max_prefixlen - 2
+    prefixLength = baseNetwork.prefixlen + max((numRoutes - 1).bit_length(), 1)
+    if prefixLength > maxPrefixLength:
+        raise Exception("Can't get enough routes from input parameters")
+    return prefixLength
+
+def splitCounts(numRoutes, distribution):
+    """Splits numRoutes over the prefix lengths of distribution, a dict of
+    prefix length to relative weight, using the largest remainder method."""
+    total = float(sum(distribution.values()))
+    shares = dict((length, numRoutes * weight / total)
+                  for length, weight in distribution.items())
+    counts = dict((length, int(share)) for length, share in shares.items())
+    remainder = numRoutes - sum(counts.values())
+    for length in sorted(shares, key=lambda l: counts[l] - shares[l])[:remainder]:
+        counts[length] += 1
+    return counts
+
+def mixedRoutes(baseNetwork, numRoutes, distribution):
+    """Plans numRoutes routes out of baseNetwork with prefix lengths that
+    follow distribution. The shortest prefixes are laid out first so that
+    every block stays aligned to its prefix length."""
+    counts = splitCounts(numRoutes, distribution)
+
+    ranges = []
+    nextAddress = 0
+    for prefixLength in sorted(counts):
+        if not counts[prefixLength]:
+            continue
+        blockSize = 1 << (baseNetwork.max_prefixlen - prefixLength)
+        offset = (nextAddress + blockSize - 1) // blockSize
+        if offset + counts[prefixLength] > 2 ** (prefixLength - baseNetwork.prefixlen):
+            raise Exception("Can't get enough routes from input parameters")
+        ranges.append(RouteRange(baseNetwork, counts[prefixLength], prefixLength, offset))
+        nextAddress = (offset + counts[prefixLength]) * blockSize
+
+    return RouteChain(*ranges)
+
+def generateRoutes(baseRange, numRoutes, subnetSize=None, distribution=None):
+    """Plans numRoutes routes out of baseRange (IPv4 or IPv6). By default
+    they are the longest prefixes that fit; subnetSize instead gives every
+    subnet of that size, and distribution a mix of prefix lengths such as
+    DFZ_MIX. The routes are returned as a lazy, sliceable sequence of
+    ip_network objects, so planning takes the same time for any count."""
+    baseNetwork = ip_network(baseRange)
+
+    if subnetSize is not None:
+        return RouteRange(baseNetwork, 2 ** (subnetSize - baseNetwork.prefixlen), subnetSize)
+
+    if distribution is not None:
+        return mixedRoutes(baseNetwork, numRoutes, distribution)
+
+    return RouteRange(baseNetwork, numRoutes, planPrefixLength(baseNetwork, numRoutes))
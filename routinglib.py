@@ -6,10 +6,17 @@ Libraries for creating L3 topologies with routing protocols.
 
 from mininet.node import Host, OVSBridge
 from mininet.nodelib import NAT
-from mininet.log import info, debug, error
+from mininet.log import info, debug, warn, error
 from mininet.cli import CLI
 from ipaddress import ip_network, ip_address, ip_interface
+from startuplib import runParallel, waitFor, processes
+from templatelib import render, renderAll, TEMPLATES
+from routelib import RouteChain, routePrefixes, isLazy, generateRoutes
+from addresslib import AddressPool
+import hashlib
 import os
+import tempfile
+import time
 
 class UserNAT(NAT):
     """Disable NIC offloading such that this NAT can be used with user space OVS."""
@@ -18,8 +25,7 @@ class UserNAT(NAT):
 
     def config(self, **kwargs):
         super(UserNAT, self).config(**kwargs)
-        disable_offload(self, self.localIntf)
-        disable_offload(self, self.defaultIntf)
+        disable_offload(self, [self.localIntf, self.defaultIntf()])
 
 class RoutedHost(Host):
     """Host that can be configured with multiple IP addresses."""
@@ -61,21 +67,33 @@ class Router(Host):
     Configures the Linux kernel for L3 forwarding and supports rich interface
     configuration of IP addresses, MAC addresses and VLANs."""
 
+    # Routers are configured before the end hosts (see startuplib)
+    configStage = 0
+
+    batchDir = '/tmp'
+
     def __init__(self, name, interfaces, *args, **kwargs):
         super(Router, self).__init__(name, **kwargs)
 
         self.interfaces = interfaces
 
-    def config(self, **kwargs):
-        super(Host, self).config(**kwargs)
+        self.sysctlFile = '%s/router-%s.sysctl' % (Router.batchDir, self.name)
+        self.flushBatchFile = '%s/router-%s-flush.batch' % (Router.batchDir, self.name)
+        self.ipBatchFile = '%s/router-%s.batch' % (Router.batchDir, self.name)
 
-        self.cmd('sysctl net.ipv4.ip_forward=1')
-        self.cmd('sysctl net.ipv4.conf.all.rp_filter=0')
-        self.cmd('sysctl net.ipv6.conf.all.forwarding=1')
+    def generateBatch(self):
+        """Compiles the interfaces dict into sysctl settings, IPv4 address
+        flushes and ip commands. Each ip command is one line of an
+        'ip -batch' script, i.e. an ip command line without the leading 'ip'."""
+        sysctls = ['net.ipv4.ip_forward=1',
+                   'net.ipv4.conf.all.rp_filter=0',
+                   'net.ipv6.conf.all.forwarding=1']
+        flushes = []
+        ipCmds = []
 
         for intf, configs in self.interfaces.items():
-            self.cmd('ip -4 addr flush dev %s' % intf)
-            self.cmd( 'sysctl net.ipv4.conf.%s.rp_filter=0' % intf )
+            flushes.append('addr flush dev %s' % intf)
+            sysctls.append('net.ipv4.conf.%s.rp_filter=0' % intf)
 
             if not isinstance(configs, list):
                 configs = [configs]
@@ -84,20 +102,41 @@ class Router(Host):
                 # Configure the vlan if there is one
                 if 'vlan' in attrs:
                     vlanName = '%s.%s' % (intf, attrs['vlan'])
-                    self.cmd('ip link add link %s name %s type vlan id %s' %
-                             (intf, vlanName, attrs['vlan']))
-                    self.cmd('ip link set %s up' % vlanName)
+                    ipCmds.append('link add link %s name %s type vlan id %s' %
+                                  (intf, vlanName, attrs['vlan']))
+                    ipCmds.append('link set %s up' % vlanName)
                     addrIntf = vlanName
                 else:
                     addrIntf = intf
 
                 # Now configure the addresses on the vlan/native interface
                 if 'mac' in attrs:
-                    self.cmd('ip link set %s down' % addrIntf)
-                    self.cmd('ip link set %s address %s' % (addrIntf, attrs['mac']))
-                    self.cmd('ip link set %s up' % addrIntf)
+                    ipCmds.append('link set %s down' % addrIntf)
+                    ipCmds.append('link set %s address %s' % (addrIntf, attrs['mac']))
+                    ipCmds.append('link set %s up' % addrIntf)
                 for addr in attrs['ipAddrs']:
-                    self.cmd('ip addr add %s dev %s' % (addr, addrIntf))
+                    ipCmds.append('addr add %s dev %s' % (addr, addrIntf))
+
+        return sysctls, flushes, ipCmds
+
+    def config(self, **kwargs):
+        super(Host, self).config(**kwargs)
+
+        sysctls, flushes, ipCmds = self.generateBatch()
+
+        writeLines(self.sysctlFile, sysctls)
+        writeLines(self.flushBatchFile, flushes)
+        writeLines(self.ipBatchFile, ipCmds)
+
+        # The flushes are IPv4 only, and a batch can't mix address families,
+        # so they get their own 'ip -4' pass. -force keeps going past errors
+        # just like separate commands would.
+        self.cmd('sysctl -q -p %s; ip -4 -force -batch %s; ip -force -batch %s'
+                 % (self.sysctlFile, self.flushBatchFile, self.ipBatchFile))
+
+        numCmds = len(sysctls) + len(flushes) + len(ipCmds)
+        debug('*** %s: applied %i interface commands in 1 shell round-trip (%i saved)\n'
+              % (self.name, numCmds, numCmds - 1))
 
 class QuaggaRouter(Router):
 
@@ -106,6 +145,10 @@ class QuaggaRouter(Router):
     binDir = '/usr/lib/quagga'
     logDir = '/var/log/quagga'
 
+    # vty port and password of each daemon
+    vtyPorts = {'zebra': 2601, 'ospfd': 2604, 'bgpd': 2605, 'pimd': 2611}
+    vtyPasswords = {'ospfd': 'hello'}
+
     def __init__(self, name, interfaces,
                  defaultRoute=None,
                  zebraConfFile=None,
@@ -133,29 +176,123 @@ class QuaggaRouter(Router):
         finally:
             os.umask(original_umask)
 
+        # A default zebra config is generated along with the protocol
+        # configs (see configJobs), or at the latest when configured
         self.zebraConfFile = zebraConfFile
+        self.zebraPending = zebraConfFile is None
         if (self.zebraConfFile is None):
             self.zebraConfFile = '%s/zebrad%s.conf' % (self.runDir, self.name)
-            self.generateZebra()
 
         self.socket = '%s/zebra%s.api' % (self.runDir, self.name)
 
         self.zebraPidFile = '%s/zebra%s.pid' % (self.runDir, self.name)
 
+        # Pid file, spawn time and spawn-to-ready time of each daemon
+        self.pidFiles = {}
+        self.spawnTimes = {}
+        self.readyTimes = {}
+
+    def zebraValues(self):
+        return {'name': self.name,
+                'logDir': QuaggaRouter.logDir,
+                'password': 'quagga',
+                'staticRoutes': [],
+                'fpm': self.fpm}
+
     def generateZebra(self):
-        configFile = open(self.zebraConfFile, 'w+')
-        configFile.write('log file %s/zebrad%s.log\n' % (QuaggaRouter.logDir, self.name))
-        configFile.write('hostname zebra-%s\n' % self.name)
-        configFile.write('password %s\n' % 'quagga')
-        if (self.fpm is not None):
-            configFile.write('fpm connection ip %s port 2620' % self.fpm)
-        configFile.close()
+        self.zebraPending = False
+        writeConfig(self.zebraConfFile, render('zebra', self.zebraValues()))
+
+    def configJobs(self):
+        """Returns a (file name, daemon, values) render job for zebra and each
+        protocol whose config still has to be generated, assigning the
+        protocols their default config file names."""
+        jobs = []
+        if self.zebraPending:
+            self.zebraPending = False
+            jobs.append((self.zebraConfFile, 'zebra', self.zebraValues()))
+        for p in self.protocols:
+            if p.configFile is None and p.daemon is not None:
+                p.configFile = p.defaultConfigFile()
+                if p.streamed():
+                    # Too big to batch, so it is streamed out right away
+                    p.generateConfig()
+                else:
+                    jobs.append((p.configFile, p.daemon, p.configValues()))
+        return jobs
+
+    @staticmethod
+    def prepareHosts(hosts):
+        generateConfigs(hosts)
+
+    def startDaemon(self, daemon, pidFile, cmd):
+        """Launches a Quagga daemon and records when it was spawned."""
+        # A stale pid file or socket would make the daemon look ready
+        for staleFile in [pidFile, self.socket if daemon == 'zebra' else None]:
+            if staleFile is not None and os.path.exists(staleFile):
+                os.remove(staleFile)
+
+        self.pidFiles[daemon] = pidFile
+        self.spawnTimes[daemon] = time.time()
+        self.readyTimes.pop(daemon, None)
+        processes.register(pidFile, self)
+        self.cmd(cmd)
+
+    def daemonReady(self, daemon):
+        """Checks whether a daemon has written its pid file and is still
+        running, and for zebra that its API socket is up. The files are on the
+        shared file system, so this needs no round-trip through the shell."""
+        if daemon == 'zebra' and not os.path.exists(self.socket):
+            return False
+        try:
+            with open(self.pidFiles[daemon]) as f:
+                pid = int(f.read().strip())
+        except (IOError, ValueError):
+            return False
+        return os.path.exists('/proc/%s' % pid)
+
+    def waitDaemon(self, daemon, timeout):
+        if daemon not in self.readyTimes:
+            if waitFor(lambda: self.daemonReady(daemon), timeout) is None:
+                warn('*** %s: %s not ready after %ss\n' % (self.name, daemon, timeout))
+                return False
+            self.readyTimes[daemon] = time.time() - self.spawnTimes[daemon]
+            debug('*** %s: %s ready after %.3fs\n' % (self.name, daemon, self.readyTimes[daemon]))
+        return True
+
+    def vtyCmd(self, commands, daemon='bgpd'):
+        """Runs commands on a daemon's vty and returns its output. The commands
+        start in enable mode, and all of them take one shell round-trip.
+        bash's /dev/tcp reaches the vty port from inside the router's
+        namespace, so unlike vtysh this works for any number of routers."""
+        lines = [self.vtyPasswords.get(daemon, 'quagga'), 'enable', 'terminal length 0']
+        lines += commands + ['exit']
+        return self.cmd("exec 3<>/dev/tcp/127.0.0.1/%s && printf '%%s\\n' %s >&3 && "
+                        "timeout 10 cat <&3; exec 3<&-"
+                        % (self.vtyPorts[daemon], ' '.join("'%s'" % line for line in lines)))
+
+    def waitReady(self, timeout=30):
+        """Waits until all the daemons of this router are up. Returns True if
+        they all came up within the timeout. The spawn-to-ready time of each
+        daemon is kept in readyTimes."""
+        deadline = time.time() + timeout
+        ready = True
+        for daemon in self.pidFiles:
+            ready = self.waitDaemon(daemon, max(deadline - time.time(), 0)) and ready
+        return ready
 
     def config(self, **kwargs):
         super(QuaggaRouter, self).config(**kwargs)
 
-        self.cmd('%s/zebra -d -f %s -z %s -i %s'
-                 % (QuaggaRouter.binDir, self.zebraConfFile, self.socket, self.zebraPidFile))
+        if self.zebraPending:
+            self.generateZebra()
+
+        self.startDaemon('zebra', self.zebraPidFile,
+                         '%s/zebra -d -f %s -z %s -i %s'
+                         % (QuaggaRouter.binDir, self.zebraConfFile, self.socket, self.zebraPidFile))
+
+        # The other daemons connect to zebra's API socket as soon as they start
+        self.waitDaemon('zebra', 10)
 
         for p in self.protocols:
             p.config(**kwargs)
@@ -163,12 +300,10 @@ class QuaggaRouter(Router):
         if self.defaultRoute:
             self.cmd('ip route add default via %s' % self.defaultRoute)
 
-        for interface in self.interfaces:
-            disable_offload(self, interface)
+        disable_offload(self, self.interfaces.keys())
 
     def terminate(self, **kwargs):
-        self.cmd("ps ax | grep '%s' | awk '{print $1}' | xargs kill"
-                 % (self.socket))
+        processes.terminate(self.pidFiles.values())
 
         for p in self.protocols:
             p.terminate(**kwargs)
@@ -179,9 +314,33 @@ class Protocol(object):
 
     """Base abstraction of a protocol that the QuaggaRouter can run."""
 
+    # Name of the Quagga daemon, which is also the name of its config template
+    daemon = None
+
     def setQuaggaRouter(self, qr):
         self.qr = qr
 
+    def defaultConfigFile(self):
+        return '%s/%s%s.conf' % (self.qr.runDir, self.daemon, self.qr.name)
+
+    def configValues(self):
+        """Returns the values the daemon's config template is rendered with.
+        Protocols add their own settings to these common ones."""
+        return {'name': self.qr.name,
+                'logDir': QuaggaRouter.logDir,
+                'password': QuaggaRouter.vtyPasswords.get(self.daemon, 'quagga')}
+
+    def streamed(self):
+        """Checks whether the config is too big to be built in memory, in
+        which case it is streamed into its file instead."""
+        return False
+
+    def generateConfig(self):
+        if self.streamed():
+            streamConfig(self.configFile, self.daemon, self.configValues())
+        else:
+            writeConfig(self.configFile, render(self.daemon, self.configValues()))
+
     def config(self, **kwargs):
         pass
 
@@ -190,7 +349,12 @@ class Protocol(object):
 
 class BgpProtocol(Protocol):
 
-    """Configures and runs the BGP protocol in Quagga."""
+    """Configures and runs the BGP protocol in Quagga.
+    routes can be a list or a lazy route source (see routelib), which is
+    streamed into the config so that any number of routes can be advertised.
+    A plain generator can only be written out once."""
+
+    daemon = 'bgpd'
 
     def __init__(self, configFile=None, asNum=None, neighbors=[], routes=[], *args, **kwargs):
         self.configFile = configFile
@@ -201,138 +365,191 @@ class BgpProtocol(Protocol):
 
     def config(self, **kwargs):
         if self.configFile is None:
-            self.configFile = '%s/bgpd%s.conf' % (self.qr.runDir, self.qr.name)
+            self.configFile = self.defaultConfigFile()
             self.generateConfig()
 
         bgpdPidFile = '%s/bgpd%s.pid' % (self.qr.runDir, self.qr.name)
 
-        self.qr.cmd('%s/bgpd -d -f %s -z %s -i %s'
-                     % (QuaggaRouter.binDir, self.configFile, self.qr.socket, bgpdPidFile))
+        self.qr.startDaemon('bgpd', bgpdPidFile,
+                            '%s/bgpd -d -f %s -z %s -i %s'
+                            % (QuaggaRouter.binDir, self.configFile, self.qr.socket, bgpdPidFile))
 
-    def generateConfig(self):
-        conf = ConfigurationWriter(self.configFile)
-
-        def getRouterId(interfaces):
-            intfAttributes = interfaces.itervalues().next()
-            print intfAttributes
-            if isinstance(intfAttributes, list):
-                # Try use the first set of attributes, but if using vlans they might not have addresses
-                intfAttributes = intfAttributes[1] if not intfAttributes[0]['ipAddrs'] else intfAttributes[0]
-            return intfAttributes['ipAddrs'][0].split('/')[0]
-
-        conf.writeLine('log file %s/bgpd%s.log' % (QuaggaRouter.logDir, self.qr.name))
-        conf.writeLine('hostname bgp-%s' % self.qr.name);
-        conf.writeLine('password %s' % 'quagga')
-        conf.writeLine('!')
-        conf.writeLine('router bgp %s' % self.asNum)
-
-        conf.indent()
-
-        conf.writeLine('bgp router-id %s' % getRouterId(self.qr.interfaces))
-        conf.writeLine('timers bgp %s' % '3 9')
-        conf.writeLine('!')
-
-        for neighbor in self.neighbors:
-            conf.writeLine('neighbor %s remote-as %s' % (neighbor['address'], neighbor['as']))
-            conf.writeLine('neighbor %s ebgp-multihop' % neighbor['address'])
-            conf.writeLine('neighbor %s timers connect %s' % (neighbor['address'], '5'))
-            conf.writeLine('neighbor %s advertisement-interval %s' % (neighbor['address'], '5'))
-            if 'port' in neighbor:
-                conf.writeLine('neighbor %s port %s' % (neighbor['address'], neighbor['port']))
-            conf.writeLine('!')
-
-        for route in self.routes:
-            conf.writeLine('network %s' % route)
-
-        conf.close()
+    def configValues(self):
+        values = super(BgpProtocol, self).configValues()
+        values.update({'asNum': self.asNum,
+                       'routerId': getRouterId(self.qr.interfaces),
+                       'neighbors': self.neighbors,
+                       # Only streamed configs take the routes as a generator,
+                       # as the others may be rendered in another process
+                       'routes': routePrefixes(self.routes) if self.streamed()
+                                 else list(routePrefixes(self.routes))})
+        return values
+
+    def streamed(self):
+        return isLazy(self.routes)
 
 class OspfProtocol(Protocol):
 
     """Configures and runs the OSPF protocol in Quagga."""
 
+    daemon = 'ospfd'
+
     def __init__(self, configFile=None, *args, **kwargs):
         self.configFile = configFile
 
     def config(self, **kwargs):
         if self.configFile is None:
-            self.configFile = '%s/ospfd%s.conf' % (self.qr.runDir, self.qr.name)
+            self.configFile = self.defaultConfigFile()
             self.generateConfig()
 
         ospfPidFile = '%s/ospf%s.pid' % (self.qr.runDir, self.qr.name)
 
-        self.qr.cmd('%s/ospfd -d -f %s -z %s -i %s'
-                     % (QuaggaRouter.binDir, self.configFile, self.qr.socket, ospfPidFile))
-
-    def generateConfig(self):
-        conf = ConfigurationWriter(self.configFile)
-
-        def getRouterId(interfaces):
-            intfAttributes = interfaces.itervalues().next()
-            print intfAttributes
-            if isinstance(intfAttributes, list):
-                # Try use the first set of attributes, but if using vlans they might not have addresses
-                intfAttributes = intfAttributes[1] if not intfAttributes[0]['ipAddrs'] else intfAttributes[0]
-            return intfAttributes['ipAddrs'][0].split('/')[0]
-
-        conf.writeLine('hostname ospf-%s' % self.qr.name);
-        conf.writeLine('password %s' % 'hello')
-        conf.writeLine('!')
-        conf.writeLine('router ospf')
-
-        conf.indent()
+        self.qr.startDaemon('ospfd', ospfPidFile,
+                            '%s/ospfd -d -f %s -z %s -i %s'
+                            % (QuaggaRouter.binDir, self.configFile, self.qr.socket, ospfPidFile))
 
-        conf.writeLine('ospf router-id %s' % getRouterId(self.qr.interfaces))
-        conf.writeLine('!')
-
-        for name, intf in self.qr.interfaces.items():
-            for ip in intf['ipAddrs']:
-                conf.writeLine('network %s area 0' % ip)
-            #if intf['ipAddrs'][0].startswith('192.168'):
-            #    writeLine(1, 'passive-interface %s' % name)
+    def configValues(self):
+        networks = []
+        for configs in self.qr.interfaces.values():
+            if not isinstance(configs, list):
+                configs = [configs]
+            for attrs in configs:
+                networks.extend(attrs['ipAddrs'])
 
-        conf.close()
+        values = super(OspfProtocol, self).configValues()
+        values.update({'routerId': getRouterId(self.qr.interfaces),
+                       'networks': networks})
+        return values
 
 class PimProtocol(Protocol):
 
     """Configures and runs the PIM protcol in Quagga."""
 
+    daemon = 'pimd'
+
     def __init__(self, configFile=None, *args, **kwargs):
         self.configFile = configFile
 
     def config(self, **kwargs):
-        pimPidFile = '%s/pim%s.pid' % (self.qr.runDir, self.qr.name)
-
-        self.qr.cmd('%s/pimd -Z -d -f %s -z %s -i %s'
-                     % (QuaggaRouter.binDir, self.configFile, self.qr.socket, pimPidFile))
-
-class ConfigurationWriter(object):
-
-    """Utility class for writing a configuration file."""
-
-    def __init__(self, filename):
-        self.filename = filename
-        self.indentValue = 0;
-
-        self.configFile = open(self.filename, 'w+')
-
-    def indent(self):
-        self.indentValue += 1
+        if self.configFile is None:
+            self.configFile = self.defaultConfigFile()
+            self.generateConfig()
 
-    def unindent(self):
-        if (self.indentValue > 0):
-            self.indentValue -= 1
+        pimPidFile = '%s/pim%s.pid' % (self.qr.runDir, self.qr.name)
 
-    def write(self, string):
-        self.configFile.write(string)
+        self.qr.startDaemon('pimd', pimPidFile,
+                            '%s/pimd -Z -d -f %s -z %s -i %s'
+                            % (QuaggaRouter.binDir, self.configFile, self.qr.socket, pimPidFile))
+
+    def configValues(self):
+        values = super(PimProtocol, self).configValues()
+        values['interfaces'] = sorted(self.qr.interfaces.keys())
+        return values
+
+def getRouterId(interfaces):
+    intfAttributes = interfaces.itervalues().next()
+    if isinstance(intfAttributes, list):
+        # Try use the first set of attributes, but if using vlans they might not have addresses
+        intfAttributes = intfAttributes[1] if not intfAttributes[0]['ipAddrs'] else intfAttributes[0]
+    return intfAttributes['ipAddrs'][0].split('/')[0]
+
+# Digest and mtime of the config files we have written or checked, so that
+# an unchanged file doesn't even have to be read again
+configDigests = {}
+
+def writeConfig(filename, content):
+    """Writes a configuration file if its content changed. The new content is
+    written to a temporary file that is renamed over the old one, so a daemon
+    never reads a half-written config. Returns True if the file was written."""
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    digest = hashlib.sha1(content).hexdigest()
+
+    try:
+        stat = os.stat(filename)
+        if stat.st_size == len(content):
+            if configDigests.get(filename) == (digest, stat.st_mtime):
+                return False
+            with open(filename) as f:
+                if hashlib.sha1(f.read()).hexdigest() == digest:
+                    configDigests[filename] = (digest, stat.st_mtime)
+                    return False
+    except OSError:
+        pass
 
-    def writeLine(self, string):
-        intentStr = ''
-        for _ in range(0, self.indentValue):
-            intentStr += '  '
-        self.write('%s%s\n' % (intentStr, string))
+    fd, tmpName = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                   prefix='.%s.' % os.path.basename(filename))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.chmod(tmpName, 0644)
+        os.rename(tmpName, filename)
+    except:
+        os.remove(tmpName)
+        raise
+
+    configDigests[filename] = (digest, os.stat(filename).st_mtime)
+    return True
+
+def streamConfig(filename, daemon, values):
+    """Renders the config of a daemon straight into a temporary file, so
+    that even a config with millions of lines takes little memory. As with
+    writeConfig, the file is only replaced if its content changed. Returns
+    True if the file was written."""
+    start = time.time()
+    fd, tmpName = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                   prefix='.%s.' % os.path.basename(filename))
+    try:
+        with os.fdopen(fd, 'w', 1 << 16) as f:
+            TEMPLATES[daemon].renderTo(f.write, values)
+
+        digest = fileDigest(tmpName)
+        try:
+            unchanged = os.path.getsize(filename) == os.path.getsize(tmpName) and \
+                fileDigest(filename) == digest
+        except OSError:
+            unchanged = False
 
-    def close(self):
-        self.configFile.close()
+        if unchanged:
+            os.remove(tmpName)
+        else:
+            os.chmod(tmpName, 0644)
+            os.rename(tmpName, filename)
+    except:
+        if os.path.exists(tmpName):
+            os.remove(tmpName)
+        raise
+
+    configDigests[filename] = (digest, os.stat(filename).st_mtime)
+    debug('*** Streamed %s in %.3fs%s\n'
+          % (filename, time.time() - start, ' (unchanged)' if unchanged else ''))
+    return not unchanged
+
+def fileDigest(filename):
+    digest = hashlib.sha1()
+    with open(filename) as f:
+        for block in iter(lambda: f.read(1 << 16), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def writeConfigs(configs):
+    """Writes a batch of configuration files, given as a dict of file name to
+    content. Returns the number of files that actually changed."""
+    written = len([filename for filename, content in configs.items()
+                   if writeConfig(filename, content)])
+    debug('*** Wrote %i of %i config files, the rest were unchanged\n'
+          % (written, len(configs)))
+    return written
+
+def generateConfigs(hosts, processes=1):
+    """Generates the zebra and protocol configs of all the QuaggaRouters
+    among hosts in one pass, rather than router by router as they are
+    configured. Returns the number of config files that changed."""
+    jobs = []
+    for host in hosts:
+        if isinstance(host, QuaggaRouter):
+            jobs.extend(host.configJobs())
+    return writeConfigs(renderAll(jobs, processes))
 
 #Backward compatibility for BGP-only use case
 class BgpRouter(QuaggaRouter):
@@ -417,7 +634,13 @@ class AutonomousSystem(object):
     """Base abstraction of an autonomous system, which implies some internal
     topology and connections to other topology elements (switches/other ASes)."""
 
-    psIdx = 1
+    # Pool the peering subnets are allocated from. The default keeps the
+    # historical 10.0.<n>.0/24 subnets, starting at 10.0.1.0/24; set a pool
+    # of /30s or /31s (see setPeeringPool) for thousands of peerings.
+    peeringPool = None
+
+    # VLAN of the next peering that uses VLANs
+    peeringVlan = 1
 
     def __init__(self, asNum, numRouters):
         self.asNum = asNum
@@ -440,17 +663,26 @@ class AutonomousSystem(object):
     def getRouter(self, i):
         return self.routerNodes[i]
 
+    @staticmethod
+    def setPeeringPool(pools, prefixLength=30):
+        """Allocates the peering subnets of all ASes out of the given pools,
+        e.g. setPeeringPool([u'10.0.0.0/16'], 31)."""
+        AutonomousSystem.peeringPool = AddressPool(pools, prefixLength)
+        return AutonomousSystem.peeringPool
+
     @staticmethod
     def generatePeeringAddresses():
-        network = ip_network(u'10.0.%s.0/24' % AutonomousSystem.psIdx)
-        AutonomousSystem.psIdx += 1
+        if AutonomousSystem.peeringPool is None:
+            AutonomousSystem.setPeeringPool([u'10.0.0.0/16'], 24).reserve(u'10.0.0.0/24')
 
-        return ip_interface('%s/%s' % (network[1], network.prefixlen)), \
-            ip_interface('%s/%s' % (network[2], network.prefixlen))
+        return AutonomousSystem.peeringPool.allocatePair()
 
     @staticmethod
     def addPeering(as1, as2, router1=1, router2=1, intf1=1, intf2=1, address1=None, address2=None, useVlans=False):
-        vlan = AutonomousSystem.psIdx if useVlans else None
+        vlan = None
+        if useVlans:
+            vlan = AutonomousSystem.peeringVlan
+            AutonomousSystem.peeringVlan += 1
 
         if address1 is None or address2 is None:
             (address1, address2) = AutonomousSystem.generatePeeringAddresses()
@@ -469,12 +701,21 @@ class AutonomousSystem(object):
 class BasicAutonomousSystem(AutonomousSystem):
 
     """Basic autonomous system containing one host and one or more routers
-    which peer with other ASes."""
+    which peer with other ASes. The host gets an address in each of routes.
+    advertisedRoutes is an optional route source (see routelib) that is
+    advertised as well but has no addresses behind it, which lets an AS
+    advertise a full table without a host address per route."""
 
-    def __init__(self, num, routes, numRouters=1):
+    def __init__(self, num, routes, numRouters=1, advertisedRoutes=None):
         super(BasicAutonomousSystem, self).__init__(65000+num, numRouters)
         self.num = num
         self.routes = routes
+        self.advertisedRoutes = advertisedRoutes
+
+    def getAdvertisedRoutes(self):
+        if self.advertisedRoutes is None:
+            return self.routes
+        return RouteChain(self.routes, self.advertisedRoutes)
 
     def addLink(self, switch, router=1):
         self.routers[router].setSwitch(switch)
@@ -523,7 +764,7 @@ class BasicAutonomousSystem(AutonomousSystem):
 
             routerNode = topology.addHost(routerName,
                                   asNum=self.asNum, neighbors=router.neighbors,
-                                  routes=self.routes,
+                                  routes=self.getAdvertisedRoutes(),
                                   cls=BgpRouter, interfaces=intfs)
 
             self.routerNodes[i] = routerNode
@@ -547,38 +788,75 @@ class BasicAutonomousSystem(AutonomousSystem):
     def getFirstAddress(self, network):
         return '%s/%s' % (network[1], network.prefixlen)
 
-# TODO fix this AS - doesn't currently work
-class RouteServerAutonomousSystem(BasicAutonomousSystem):
+class RouteServerAutonomousSystem(AutonomousSystem):
 
-    def __init__(self, routerAddress, *args, **kwargs):
-        BasicAutonomousSystem.__init__(self, *args, **kwargs)
+    """Route server on a shared peering LAN, as at an IXP. Each member AS
+    has a single eBGP session, with the route server, which passes routes
+    on between the members without putting itself in their AS path or next
+    hop. Members are given addresses on the LAN (an OVSBridge) in the order
+    they are added. Members must all be added before the route server is
+    built, as its neighbors are fixed then, and the route server must be
+    built before its members, as BasicAutonomousSystem members link their
+    routers to the LAN directly. SDN speakers reach it through the switch it
+    connects to."""
 
-        self.routerAddress = routerAddress
+    def __init__(self, num, peeringSubnet=u'192.168.60.0/24', asNum=None):
+        super(RouteServerAutonomousSystem, self).__init__(65000+num if asNum is None else asNum, 1)
+        self.num = num
+        self.peeringSubnet = ip_network(peeringSubnet)
+        self.lanAddresses = self.peeringSubnet.hosts()
+        self.address = self.nextLanAddress()
+        self.switchName = 'rs%isw' % self.num
+        self.built = False
+
+    def nextLanAddress(self):
+        return ip_interface(u'%s/%s' % (next(self.lanAddresses), self.peeringSubnet.prefixlen))
+
+    def addMember(self, member, router=1, intf=1):
+        """Adds an AS to the peering LAN, peering its given router (and
+        interface) with the route server."""
+        if self.built:
+            raise Exception('Members of route server %i must be added before it is built'
+                            % self.num)
+        address = self.nextLanAddress()
+        member.peerWith(router, address, self.address, self.asNum, intf=intf)
+
+        self.routers[1].addNeighbor(address, member.asNum)
+        self.routers[1].neighbors[-1]['routeServerClient'] = True
+
+        if isinstance(member, BasicAutonomousSystem):
+            member.addLink(self.switchName, router)
 
     def build(self, topology, connectAtSwitch):
-
-        switch = topology.addSwitch('as%isw' % self.num, cls=OVSBridge)
-
-        self.addRouterAndHost(topology, self.routerAddress, switch)
+        switch = topology.addSwitch(self.switchName, cls=OVSBridge)
 
         rsName = 'rs%i' % self.num
-        routeServer = topology.addHost(rsName,
-                                       self.asnum, self.neighbors,
-                                       cls=BgpRouter,
-                                       interfaces={'%s-eth0' % rsName : {'ipAddrs':[self.peeringAddress]}})
+        routeServer = topology.addHost(rsName, cls=BgpRouter,
+                                       asNum=self.asNum,
+                                       neighbors=list(self.routers[1].neighbors),
+                                       interfaces={'%s-eth0' % rsName :
+                                                   {'ipAddrs':[self.address.with_prefixlen]}})
+        self.routerNodes[1] = routeServer
 
         topology.addLink(routeServer, switch)
         topology.addLink(switch, connectAtSwitch)
+        self.built = True
 
 class SdnAutonomousSystem(AutonomousSystem):
 
     """Runs the internal BGP speakers needed for ONOS routing apps like
-    SDN-IP."""
+    SDN-IP.
+
+    By default the speakers form a full iBGP mesh. routeReflectors instead
+    lists the speakers (by index, from 1) that act as route reflectors: they
+    mesh with each other and every other speaker only peers with them, as
+    their route-reflector client. With routeReflectors='onos' the speakers
+    only peer with ONOS, which reflects their routes."""
 
     routerIdx = 1
 
     def __init__(self, onosIps, num=1, numBgpSpeakers=1, asNum=65000, externalOnos=True,
-                 peerIntfConfig=None, withFpm=False):
+                 peerIntfConfig=None, withFpm=False, routeReflectors=None):
         super(SdnAutonomousSystem, self).__init__(asNum, numBgpSpeakers)
         self.onosIps = onosIps
         self.num = num
@@ -587,19 +865,32 @@ class SdnAutonomousSystem(AutonomousSystem):
         self.withFpm = withFpm
         self.externalOnos= externalOnos
         self.internalPeeringSubnet = ip_network(u'1.1.1.0/24')
+        self.routeReflectors = routeReflectors
 
-        for router in self.routers.values():
+        for j, router in self.routers.items():
             # Add iBGP sessions to ONOS nodes
             for onosIp in onosIps:
                 router.neighbors.append({'address':onosIp, 'as':asNum, 'port':2000})
 
             # Add iBGP sessions to other BGP speakers
             for i, router2 in self.routers.items():
-                if router == router2:
+                if router == router2 or not self.hasSession(j, i):
                     continue
                 cpIpBase = self.num*10
                 ip = AutonomousSystem.getIthAddress(self.internalPeeringSubnet, cpIpBase+i)
-                router.neighbors.append({'address':ip.ip, 'as':asNum})
+                neighbor = {'address':ip.ip, 'as':asNum}
+                if self.isReflector(j) and not self.isReflector(i):
+                    neighbor['routeReflectorClient'] = True
+                router.neighbors.append(neighbor)
+
+    def isReflector(self, i):
+        return self.routeReflectors not in (None, 'onos') and i in self.routeReflectors
+
+    def hasSession(self, i, j):
+        """Checks whether speakers i and j have an iBGP session."""
+        if self.routeReflectors is None:
+            return True
+        return self.isReflector(i) or self.isReflector(j)
 
     def build(self, topology, connectAtSwitch, controlSwitch):
 
@@ -647,29 +938,29 @@ class SdnAutonomousSystem(AutonomousSystem):
             topology.addLink(controlSwitch, nat)
 
 
-def generateRoutes(baseRange, numRoutes, subnetSize=None):
-    baseNetwork = ip_network(baseRange)
-
-    # We need to get at least 2 addresses out of each subnet, so the biggest
-    # prefix length we can have is /30
-    maxPrefixLength = baseNetwork.max_prefixlen - 2
-
-    if subnetSize is not None:
-        return list(baseNetwork.subnets(new_prefix=subnetSize))
+def waitForRouters(hosts, timeout=30, maxWorkers=64):
+    """Waits for the daemons of all the Quagga routers among hosts to come up,
+    probing the routers concurrently. Returns True if they were all ready
+    within the timeout."""
+    routers = [host for host in hosts if isinstance(host, QuaggaRouter)]
+    results = runParallel(lambda router: router.waitReady(timeout), routers, maxWorkers)
 
-    trySubnetSize = baseNetwork.prefixlen + 1
-    while trySubnetSize <= maxPrefixLength and \
-            len(list(baseNetwork.subnets(new_prefix=trySubnetSize))) < numRoutes:
-        trySubnetSize += 1
+    slowest = {}
+    for router in routers:
+        for daemon, readyTime in router.readyTimes.items():
+            slowest[daemon] = max(slowest.get(daemon, 0), readyTime)
+    for daemon, readyTime in sorted(slowest.items()):
+        info('*** Slowest %s spawn-to-ready time: %.3fs\n' % (daemon, readyTime))
 
-    if trySubnetSize > maxPrefixLength:
-        raise Exception("Can't get enough routes from input parameters")
-
-    return list(baseNetwork.subnets(new_prefix=trySubnetSize))[:numRoutes]
+    return all(ready for ready, _ in results.values())
 
 class RoutingCli( CLI ):
 
-    """CLI command that can bring a host up or down. Useful for simulating router failure."""
+    """CLI command that can bring a host up or down. Useful for simulating router failure.
+    The converge command then measures how long routing takes to settle."""
+
+    # Time of the last host up/down, which reconvergence is measured from
+    lastChange = None
 
     def do_host( self, line ):
         args = line.split()
@@ -690,12 +981,51 @@ class RoutingCli( CLI ):
                 error( 'invalid command: host <host name> {up, down}\n' )
                 return
 
-            for intf in self.mn.get( host ).intfList( ):
-                intf.link.intf1.ifconfig( op )
-                intf.link.intf2.ifconfig( op )
+            setHostLinks( self.mn.get( host ), op )
+            self.lastChange = time.time()
 
-# Disable NIC offloading
-def disable_offload(host, intf):
-    for attr in ["rx", "tx", "sg"]:
-        cmd = "/sbin/ethtool --offload %s %s off" % (intf, attr)
-        host.cmd(cmd)
+    def do_converge( self, line ):
+        "converge [timeout]: measure how long routing takes to settle after the last host up/down"
+        # Imported here as convergencelib builds on this module
+        from convergencelib import ConvergenceMonitor
+
+        args = line.split()
+        timeout = float( args[ 0 ] ) if args else 60
+        monitor = ConvergenceMonitor( self.mn, timeout=timeout )
+        monitor.measure( start=self.lastChange, requireFull=False )
+        monitor.printReport()
+
+def setHostLinks( host, op ):
+    """Brings both ends of all of a host's links up or down."""
+    for intf in host.intfList( ):
+        intf.link.intf1.ifconfig( op )
+        intf.link.intf2.ifconfig( op )
+
+# NIC offload features that get in the way of user space OVS
+OFFLOAD_FEATURES = ["rx", "tx", "sg"]
+
+# Disable NIC offloading on one interface or a list of interfaces of a host.
+# Each interface takes a single ethtool call and all of them are run in one
+# shell round-trip. The host remembers which interfaces are already done,
+# and those are skipped.
+def disable_offload(host, intfs):
+    if not isinstance(intfs, (list, tuple, set)):
+        intfs = [intfs]
+
+    done = host.__dict__.setdefault('offloadDisabled', set())
+    todo = []
+    for intf in [str(intf) for intf in intfs]:
+        if intf not in done and intf not in todo:
+            todo.append(intf)
+    if not todo:
+        return
+
+    features = ' '.join('%s off' % feature for feature in OFFLOAD_FEATURES)
+    host.cmd('; '.join('/sbin/ethtool --offload %s %s' % (intf, features) for intf in todo))
+    done.update(todo)
+
+# Write a list of lines out to a file, e.g. an 'ip -batch' or 'sysctl -p' file
+def writeLines(filename, lines):
+    with open(filename, 'w') as f:
+        for line in lines:
+            f.write('%s\n' % line)
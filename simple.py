@@ -1,7 +1,7 @@
 #!/usr/bin/python
 
 from mininet.topo import Topo
-from mininet.net import Mininet
+from startuplib import ParallelMininet as Mininet
 from mininet.node import RemoteController, OVSBridge
 from mininet.cli import CLI
 from mininet.log import setLogLevel, info
@@ -45,10 +45,15 @@ class SdnTopo( Topo ):
         as3.addLink(sw6)
         as3.build(self)
 
-        # AS containing a route server
-        #as4 = RouteServerAutonomousSystem('192.168.60.2/24', 4, '192.168.60.1/24', 
-        #                                  [ip_network(u'172.16.60.0/24')])
-        #as4.build(self, sw4);
+        # Route server on a peering LAN, which the SDN AS and AS 5 peer with.
+        # It is built once its members are added, and before they are built,
+        # as their routers link to the LAN
+        rs4 = RouteServerAutonomousSystem(4, u'192.168.60.0/24')
+        as5 = BasicAutonomousSystem(5, [ip_network(u'172.16.50.0/24')])
+        rs4.addMember(sdnAs)
+        rs4.addMember(as5)
+        rs4.build(self, sw4)
+        as5.build(self)
         
         cs0 = self.addSwitch('cs0', cls=OVSBridge)
         
@@ -0,0 +1,299 @@
+#!/usr/bin/python
+
+"""
+Libraries for speeding up the start-up and teardown of large Mininet topologies.
+"""
+
+from mininet.net import Mininet
+from mininet.nodelib import NAT
+from mininet.log import info, debug
+from profilelib import enableProfiling
+from threading import Thread, Lock
+from Queue import Queue, Empty
+import errno
+import math
+import os
+import signal
+import sys
+import time
+
+# Default size of the worker pools used to configure nodes
+DEFAULT_WORKERS = 16
+
+def runParallel(func, items, maxWorkers=DEFAULT_WORKERS):
+    """Calls func on every item using a pool of at most maxWorkers threads.
+    Returns a dict mapping each item to a (result, elapsed seconds) tuple.
+    If func raises, the first exception is re-raised once all the workers
+    have finished."""
+    items = list(items)
+    results = {}
+    errors = []
+
+    queue = Queue()
+    for item in items:
+        queue.put(item)
+
+    def worker():
+        while True:
+            try:
+                item = queue.get_nowait()
+            except Empty:
+                return
+            start = time.time()
+            result = None
+            try:
+                result = func(item)
+            except Exception:
+                errors.append(sys.exc_info())
+            results[item] = (result, time.time() - start)
+
+    threads = [Thread(target=worker) for _ in range(min(maxWorkers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        excType, excValue, excTraceback = errors[0]
+        raise excType, excValue, excTraceback
+
+    return results
+
+def waitFor(condition, timeout, initialDelay=0.01, maxDelay=0.5):
+    """Polls condition with exponential backoff until it returns True.
+    Returns the time waited in seconds, or None if the timeout expired."""
+    start = time.time()
+    delay = initialDelay
+    while not condition():
+        elapsed = time.time() - start
+        if elapsed >= timeout:
+            return None
+        time.sleep(min(delay, timeout - elapsed))
+        delay = min(delay * 2, maxDelay)
+    return time.time() - start
+
+def percentile(values, pct):
+    """Returns the pct-th percentile of values using the nearest-rank method,
+    or None if there are no values."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+class ProcessRegistry(object):
+
+    """Keeps track of the pid files of the daemons started inside the
+    emulation, so that they can all be stopped in one batch rather than by
+    scanning the process table for each node. The pid files are also listed
+    in a file so that a crashed emulation can still be cleaned up. A pid is
+    only signalled while its process still has the pid file on its command
+    line, as all the daemons do, so that a pid that has been reused since is
+    left alone."""
+
+    def __init__(self, filename='/tmp/routing-pidfiles'):
+        self.filename = filename
+        self.lock = Lock()
+        # The registered pid files, read from the file on first use and
+        # kept in step with it after that
+        self.pidFiles = None
+        # Node that registered each pid file, of those registered here
+        self.owners = {}
+
+    def readPidFiles(self):
+        try:
+            with open(self.filename) as f:
+                return [line.strip() for line in f if line.strip()]
+        except IOError:
+            return []
+
+    def writePidFiles(self, pidFiles):
+        with open(self.filename, 'w') as f:
+            for pidFile in pidFiles:
+                f.write('%s\n' % pidFile)
+
+    def registered(self):
+        """Returns the set of registered pid files. Must hold the lock."""
+        if self.pidFiles is None:
+            self.pidFiles = set(self.readPidFiles())
+        return self.pidFiles
+
+    def register(self, pidFile, owner=None):
+        """Records the pid file of a daemon that has just been spawned by
+        the owner node."""
+        with self.lock:
+            if owner is not None:
+                self.owners[pidFile] = owner
+            if pidFile not in self.registered():
+                self.pidFiles.add(pidFile)
+                with open(self.filename, 'a') as f:
+                    f.write('%s\n' % pidFile)
+
+    def pidFilesOf(self, nodes):
+        """Returns the pid files registered by the given nodes."""
+        nodes = set(nodes)
+        with self.lock:
+            return [pidFile for pidFile, owner in self.owners.items() if owner in nodes]
+
+    @staticmethod
+    def readPid(pidFile):
+        try:
+            with open(pidFile) as f:
+                return int(f.read().strip())
+        except (IOError, ValueError):
+            return None
+
+    @staticmethod
+    def signal(pid, sig):
+        """Sends a signal to a process. Returns False if it doesn't exist."""
+        try:
+            os.kill(pid, sig)
+        except OSError as e:
+            if e.errno == errno.ESRCH:
+                return False
+            raise
+        return True
+
+    @staticmethod
+    def ownsPid(pid, pidFile):
+        """Checks whether a process was started with pidFile as an argument,
+        i.e. is the daemon that wrote it."""
+        try:
+            with open('/proc/%s/cmdline' % pid) as f:
+                return pidFile in f.read().split('\0')
+        except IOError:
+            return False
+
+    @staticmethod
+    def isRunning(pid):
+        """Checks whether a process exists and isn't a zombie."""
+        try:
+            with open('/proc/%s/stat' % pid) as f:
+                # The state follows the command name, which is in parentheses
+                return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+        except (IOError, IndexError):
+            return False
+
+    def terminate(self, pidFiles=None, timeout=5):
+        """Stops the daemons of the given pid files, or of all registered pid
+        files. They are all sent SIGTERM at once and waited for together;
+        any still running after the timeout are sent SIGKILL. The lock is
+        only held to take them off the registry, not while waiting."""
+        with self.lock:
+            registered = self.registered()
+            if pidFiles is None:
+                pidFiles = list(registered)
+            pidFiles = [pidFile for pidFile in pidFiles if pidFile]
+
+            pids = set()
+            for pidFile in pidFiles:
+                pid = self.readPid(pidFile)
+                if pid is None or pid in pids:
+                    continue
+                if not self.ownsPid(pid, pidFile):
+                    debug('*** Not stopping pid %s, which is no longer the daemon of %s\n'
+                          % (pid, pidFile))
+                elif self.signal(pid, signal.SIGTERM):
+                    pids.add(pid)
+
+            for pidFile in pidFiles:
+                self.owners.pop(pidFile, None)
+            if registered.intersection(pidFiles):
+                registered.difference_update(pidFiles)
+                self.writePidFiles(sorted(registered))
+
+        exited = lambda: not any(self.isRunning(pid) for pid in pids)
+        if pids and waitFor(exited, timeout) is None:
+            for pid in pids:
+                if self.signal(pid, signal.SIGKILL):
+                    debug('*** Killed pid %s, which ignored SIGTERM\n' % pid)
+
+        for pidFile in pidFiles:
+            if os.path.exists(pidFile):
+                os.remove(pidFile)
+
+# Registry of all the daemons started by the node classes
+processes = ProcessRegistry()
+
+def configStage(node):
+    """Returns the start-up stage of a node. Nodes in a lower stage are fully
+    configured before any node of a higher stage is touched. Node classes
+    set the configStage class attribute; Mininet's NAT provides the
+    management network so it always goes first."""
+    if isinstance(node, NAT):
+        return 0
+    return getattr(node, 'configStage', 1)
+
+def prepareHosts(hosts):
+    """Calls the prepareHosts() static method of the hosts' classes once per
+    distinct method with all the hosts, so that node classes can do work for
+    all of their nodes in one batch (such as generating config files) before
+    any host is configured."""
+    hooks = []
+    for host in hosts:
+        hook = getattr(type(host), 'prepareHosts', None)
+        if hook is not None and hook not in hooks:
+            hooks.append(hook)
+    for hook in hooks:
+        hook(hosts)
+
+def configHost(host):
+    """Configures a host the same way Mininet.configHosts does."""
+    if host.defaultIntf():
+        host.configDefault()
+    else:
+        # Don't configure nonexistent intf
+        host.configDefault(ip=None, mac=None)
+
+class ParallelMininet(Mininet):
+
+    """Mininet that configures its hosts in parallel on a bounded thread pool.
+    Every host has its own namespace and shell, so their config() calls are
+    independent, apart from the ordering given by configStage(). The wall
+    time of each host's configuration is kept in configTimes.
+
+    If traceFile is given, or the ROUTING_TRACE environment variable is set,
+    the start-up is profiled and a trace is written on exit (see profilelib)."""
+
+    def __init__(self, *args, **kwargs):
+        # Mininet.__init__ builds the network, so these must be set first
+        self.maxWorkers = kwargs.pop('maxWorkers', DEFAULT_WORKERS)
+        self.configTimes = {}
+
+        traceFile = kwargs.pop('traceFile', os.environ.get('ROUTING_TRACE'))
+        if traceFile:
+            enableProfiling(traceFile)
+
+        super(ParallelMininet, self).__init__(*args, **kwargs)
+
+    def configHosts(self):
+        stages = {}
+        for host in self.hosts:
+            stages.setdefault(configStage(host), []).append(host)
+
+        start = time.time()
+        prepareHosts(self.hosts)
+        for stage in sorted(stages.keys()):
+            hosts = stages[stage]
+            debug('*** Configuring stage %i: %s\n'
+                  % (stage, ' '.join(host.name for host in hosts)))
+            results = runParallel(configHost, hosts, self.maxWorkers)
+            for host, (_, elapsed) in results.items():
+                self.configTimes[host.name] = elapsed
+                info(host.name + ' ')
+        info('\n')
+
+        if self.configTimes:
+            slowest = max(self.configTimes, key=self.configTimes.get)
+            info('*** Configured %i hosts in %.2fs (slowest: %s %.2fs)\n'
+                 % (len(self.configTimes), time.time() - start,
+                    slowest, self.configTimes[slowest]))
+
+    def stop(self):
+        # Stop every daemon of this network in one batch so that the hosts'
+        # terminate() calls have nothing left to wait for. Those of other
+        # networks, or left over from a crashed run, are left alone
+        info('*** Stopping daemons\n')
+        processes.terminate(processes.pidFilesOf(self.hosts))
+        super(ParallelMininet, self).stop()
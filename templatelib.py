@@ -0,0 +1,175 @@
+#!/usr/bin/python
+
+"""
+Libraries for rendering Quagga daemon configurations from templates.
+
+Templates are plain config text where {name} is substituted with a value
+(str.format syntax, so {neighbor[address]} works too), and lines starting
+with '%' are control statements:
+
+    % for <name> in <name>
+    % if <python expression>
+    % end
+
+Each template is compiled once into a Python function, so rendering is just
+a run of string formatting.
+"""
+
+from mininet.log import debug
+from multiprocessing import Pool
+import re
+import time
+
+class Template(object):
+
+    """A template compiled into a Python function."""
+
+    def __init__(self, name, text):
+        self.name = name
+        self.conditions = []
+
+        source = ['def render(_write, _scope):']
+        depth = 1
+        for line in text.strip('\n').split('\n'):
+            statement = line.strip()
+            if statement.startswith('%'):
+                statement = statement[1:].strip()
+                loop = re.match(r'for (\w+) in (\w+)$', statement)
+                if loop:
+                    source.append('    ' * depth + 'for _scope[%r] in _scope[%r]:'
+                                  % (loop.group(1), loop.group(2)))
+                    depth += 1
+                elif statement.startswith('if '):
+                    self.conditions.append(compile(statement[3:], name, 'eval'))
+                    source.append('    ' * depth + 'if eval(_conditions[%i], {}, _scope):'
+                                  % (len(self.conditions) - 1))
+                    depth += 1
+                elif statement == 'end':
+                    source.append('    ' * depth + 'pass')
+                    depth -= 1
+                else:
+                    raise Exception('%s: bad template statement: %s' % (name, line))
+            elif '{' in line:
+                source.append('    ' * depth + '_write(%r.format(**_scope))' % (line + '\n'))
+            else:
+                source.append('    ' * depth + '_write(%r)' % (line + '\n'))
+
+        if depth != 1:
+            raise Exception('%s: unterminated template block' % name)
+
+        namespace = {'_conditions': self.conditions}
+        exec compile('\n'.join(source), name, 'exec') in namespace
+        self.renderFunc = namespace['render']
+
+    def renderTo(self, write, values):
+        """Renders the template, passing the output piece by piece to write."""
+        self.renderFunc(write, dict(values))
+
+    def render(self, values):
+        chunks = []
+        self.renderTo(chunks.append, values)
+        return ''.join(chunks)
+
+ZEBRA_TEMPLATE = Template('zebra', '''
+log file {logDir}/zebrad{name}.log
+hostname zebra-{name}
+password {password}
+% for route in staticRoutes
+!
+ip route {route}
+% end
+% if fpm
+!
+fpm connection ip {fpm} port 2620
+% end
+''')
+
+BGPD_TEMPLATE = Template('bgpd', '''
+log file {logDir}/bgpd{name}.log
+hostname bgp-{name}
+password {password}
+!
+router bgp {asNum}
+  bgp router-id {routerId}
+  timers bgp 3 9
+  !
+% for neighbor in neighbors
+  neighbor {neighbor[address]} remote-as {neighbor[as]}
+  neighbor {neighbor[address]} ebgp-multihop
+  neighbor {neighbor[address]} timers connect 5
+  neighbor {neighbor[address]} advertisement-interval 5
+% if 'port' in neighbor
+  neighbor {neighbor[address]} port {neighbor[port]}
+% end
+% if neighbor.get('routeReflectorClient')
+  neighbor {neighbor[address]} route-reflector-client
+% end
+% if neighbor.get('routeServerClient')
+  neighbor {neighbor[address]} route-server-client
+% end
+  !
+% end
+% for route in routes
+  network {route}
+% end
+''')
+
+OSPFD_TEMPLATE = Template('ospfd', '''
+hostname ospf-{name}
+password {password}
+!
+router ospf
+  ospf router-id {routerId}
+  !
+% for network in networks
+  network {network} area 0
+% end
+''')
+
+PIMD_TEMPLATE = Template('pimd', '''
+log file {logDir}/pimd{name}.log
+hostname pim-{name}
+password {password}
+!
+% for intf in interfaces
+interface {intf}
+  ip pim ssm
+  ip igmp
+!
+% end
+ip multicast-routing
+''')
+
+TEMPLATES = {'zebra': ZEBRA_TEMPLATE,
+             'bgpd': BGPD_TEMPLATE,
+             'ospfd': OSPFD_TEMPLATE,
+             'pimd': PIMD_TEMPLATE}
+
+def render(daemon, values):
+    """Renders the config of a daemon (zebra, bgpd, ospfd or pimd)."""
+    return TEMPLATES[daemon].render(values)
+
+def renderJobs(jobs):
+    return [(filename, render(daemon, values)) for filename, daemon, values in jobs]
+
+def renderAll(jobs, processes=1):
+    """Renders a batch of configs in one pass. jobs is a list of (file name,
+    daemon, values) tuples, and a dict of file name to config is returned.
+    With processes > 1 the jobs are spread over a pool of processes. The
+    configs have to be pickled back to this process, so this only pays off
+    for very large batches of large configs."""
+    start = time.time()
+    if processes > 1 and len(jobs) > processes:
+        chunkSize = (len(jobs) + processes - 1) / processes
+        chunks = [jobs[i:i + chunkSize] for i in range(0, len(jobs), chunkSize)]
+        pool = Pool(processes)
+        try:
+            results = [config for chunk in pool.map(renderJobs, chunks) for config in chunk]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = renderJobs(jobs)
+
+    debug('*** Rendered %i configs in %.3fs\n' % (len(jobs), time.time() - start))
+    return dict(results)
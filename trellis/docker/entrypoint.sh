@@ -18,16 +18,17 @@ NETCFG=${EXTERNAL_VOLUME}/${NETCFG_FILE}
 echo "Check custom config, ${NETCFG}"
 
 # Use custom file if ${NETCFG_FILE} be set
+# Only the configs that differ from the ones ONOS has are sent
 if [[ ${NETCFG_FILE} ]]; then
     if [ -f ${NETCFG} ]; then
         echo "Detected custom cfg ${NETCFG}, use it"
-        onos-netcfg ${ONOS_IP} ${NETCFG} || exit 0
+        ./onosrestlib.py ${ONOS_IP} ${NETCFG} || exit 0
     else
         echo "${NETCFG} does not exist"
         exit 0
     fi
 else
-    onos-netcfg ${ONOS_IP} ${TOPO}.json || exit 0
+    ./onosrestlib.py ${ONOS_IP} ${TOPO}.json || exit 0
 fi
 
 # Start mininet
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+"""
+Libraries for generating leaf-spine Trellis fabrics of any size.
+
+fabricGraph() lays out a fabric of N spines and M leaves in the compiled
+form of speclib, and Fabric is the matching Topo. Switch names, DPIDs,
+host MACs and port numbers are all worked out from the indices, so the
+same parameters always give the same fabric. Ports are numbered as follows:
+
+    spine:  leaf j, link k                        -> 1 + j * spineLinks + k
+    leaf:   spine i, link k                       -> 1 + i * spineLinks + k
+            then the links to its paired leaf, then its hosts
+
+A fabric can also be given as the "fabric" section of a topology spec.
+"""
+
+from speclib import SpecTopo
+
+def fabricGraph(spines=2, leaves=2, spineLinks=1, pairLinks=0,
+                hostsPerLeaf=0, hostCls='DhcpClient', hostParams={},
+                dualHomedHostsPerPair=0, dualHomedCls='DualHomedDhcpClient',
+                leafDpidBase=204, spineDpidBase=None):
+    """Returns the switches, hosts and links of a fabric, in the form of a
+    compiled topology spec.
+
+    spineLinks is the number of parallel links between each leaf and each
+    spine. With pairLinks or dualHomedHostsPerPair set, leaves 2k and 2k+1
+    form a pair, joined by pairLinks links, and dualHomedHostsPerPair hosts
+    are linked to both leaves of each pair. Every leaf also gets
+    hostsPerLeaf single-homed hosts. Switches are named after their DPIDs;
+    the spines follow the leaves unless spineDpidBase is given."""
+    paired = pairLinks > 0 or dualHomedHostsPerPair > 0
+    if paired and leaves % 2:
+        raise Exception('Paired leaves need an even number of leaves, not %s' % leaves)
+    if spineDpidBase is None:
+        spineDpidBase = max(226, leafDpidBase + leaves)
+
+    spineNames = ['s%d' % (spineDpidBase + i) for i in range(spines)]
+    leafNames = ['s%d' % (leafDpidBase + j) for j in range(leaves)]
+    # Switches are named after their dpid
+    switches = [(name, {'dpid': name[1:]}) for name in leafNames + spineNames]
+    hosts = []
+    links = []
+
+    for i, spine in enumerate(spineNames):
+        for j, leaf in enumerate(leafNames):
+            for k in range(spineLinks):
+                links.append([spine, leaf, {'port1': 1 + j * spineLinks + k,
+                                            'port2': 1 + i * spineLinks + k}])
+
+    # Next free port of each leaf
+    nextPort = dict((leaf, 1 + spines * spineLinks) for leaf in leafNames)
+
+    if pairLinks:
+        for j in range(0, leaves, 2):
+            leaf1, leaf2 = leafNames[j], leafNames[j + 1]
+            for k in range(pairLinks):
+                links.append([leaf1, leaf2, {'port1': nextPort[leaf1], 'port2': nextPort[leaf2]}])
+                nextPort[leaf1] += 1
+                nextPort[leaf2] += 1
+
+    def addHost(name, leafList, cls, macPrefix, n):
+        params = dict(hostParams, cls=cls, mac='%s:%02x:%02x:%02x:%02x' % (
+            macPrefix, (n >> 24) & 0xff, (n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff))
+        hosts.append((name, params))
+        for leaf in leafList:
+            links.append([name, leaf, {'port2': nextPort[leaf]}])
+            nextPort[leaf] += 1
+
+    n = 1
+    for leaf in leafNames:
+        for _ in range(hostsPerLeaf):
+            addHost('h%d' % n, [leaf], hostCls, '00:aa', n)
+            n += 1
+
+    if dualHomedHostsPerPair:
+        n = 1
+        for j in range(0, leaves, 2):
+            for _ in range(dualHomedHostsPerPair):
+                addHost('dh%d' % n, leafNames[j:j + 2], dualHomedCls, '00:cc', n)
+                n += 1
+
+    return {'switches': switches, 'hosts': hosts, 'links': links}
+
+class Fabric(SpecTopo):
+
+    """Leaf-spine fabric topology, taking the parameters of fabricGraph()."""
+
+    def build(self, **params):
+        SpecTopo.build(self, fabricGraph(**params))
@@ -0,0 +1,446 @@
+#!/usr/bin/python
+
+"""
+Libraries for generating the ONOS network config (netcfg) of a topology.
+
+netcfgSections() walks a Topo, e.g. a SpecTopo or Fabric, and works out the
+ports, devices, hosts and DHCP relay sections of the segment routing netcfg
+from the addressing held by its nodes, so the netcfg is generated on every
+start rather than kept in step with the topology by hand:
+
+    writeNetcfg(netcfgSections(topo, subnets={'h*@s204': ['10.0.2.254/24']}),
+                'netcfg.json')
+
+Fabric switches are the switches that aren't bridges (OVSBridge); the hosts
+behind a bridge count as attached to the fabric port the bridge is on. The
+subnets of a fabric port, given as the fabric's address on them, come from
+what is attached to it:
+
+    hosts with a gateway (RoutedHost, DhcpServer...)  their gateway
+    routers (nodes with interfaces)                   the last address of the
+                                                      linked interface's subnets
+    others (e.g. DhcpClient)                          their entry in subnets
+
+Each subnet gets an untagged VLAN, in the order the subnets are found,
+unless given one in vlans. Hosts with a vlan parameter (TaggedRoutedHost,
+TaggedDhcpClient) and router interface configs with a vlan make the port
+tagged instead, their subnets taking that VLAN.
+
+Run as a script, it writes the netcfg of a topology spec or of a Python
+topology, whose netcfg dict holds the parameters above, or checks it against
+a netcfg kept by hand:
+
+    ./netcfglib.py trellis.topo.json --check trellis.json
+    ./netcfglib.py trellis_dualhome.py --check trellis_dualhome.json
+"""
+
+import sys
+sys.path.append('..')
+from mininet.node import OVSBridge
+from mininet.log import info
+from mininet.util import natural
+from ipaddress import ip_interface
+from trellislib import DhcpServer, Dhcp6Server
+from fnmatch import fnmatch
+import json
+import os
+import re
+import tempfile
+
+def nodeClass(params):
+    cls = params.get('cls')
+    # Unwrap functools.partial
+    return getattr(cls, 'func', cls)
+
+def isSubclass(params, classes):
+    cls = nodeClass(params)
+    return isinstance(cls, type) and issubclass(cls, classes)
+
+def deviceId(name, params):
+    """Returns the ONOS device ID of a switch, from its dpid or, like
+    Mininet, from the first number in its name."""
+    dpid = params.get('dpid')
+    if dpid:
+        dpid = dpid.replace(':', '')
+    else:
+        dpid = '%x' % int(re.findall(r'\d+', name)[0])
+    return 'of:%016x' % int(dpid, 16)
+
+def nodeSid(name, params):
+    """Returns the node SID of a switch. By the convention of the Trellis
+    topologies (dpid '204' is s204, SID 204) the digits of the dpid are read
+    as a decimal number."""
+    dpid = params.get('dpid') or re.findall(r'\d+', name)[0]
+    return int(dpid) if dpid.isdigit() else int(dpid.replace(':', ''), 16)
+
+def gatewayAddress(address, gateways):
+    """Returns the fabric's address on a router's subnet: the last address
+    of the subnet, e.g. 10.0.1.254/24 for 10.0.1.2/24. Addresses already
+    worked out are looked up in gateways."""
+    if address not in gateways:
+        network = ip_interface(unicode(address)).network
+        last = network.broadcast_address if network.version == 6 else network.broadcast_address - 1
+        gateways[address] = '%s/%s' % (last, network.prefixlen)
+    return gateways[address]
+
+def matchSubnets(subnets, name, switch):
+    """Looks a host up in subnets, by name or by 'host@switch' pattern."""
+    if callable(subnets):
+        return subnets(name, switch)
+    if name in subnets:
+        return subnets[name]
+    target = '%s@%s' % (name, switch)
+    for pattern, ips in subnets.items():
+        if fnmatch(target, pattern):
+            return ips
+    return []
+
+def nodeSubnets(name, params, port, switch, subnets, gateways):
+    """Returns the fabric addresses of the subnets of a node attached to
+    switch through its port, as (VLAN, addresses) pairs where the VLAN is
+    None for untagged ones. Each config of a router interface has its own
+    VLAN; other nodes have at most one. gateways caches gatewayAddress()."""
+    vlan = params.get('vlan')
+    if 'gateway' in params and params.get('ips'):
+        gateway = params['gateway']
+        return [(vlan, ['%s/%s' % (gateway, ip.split('/')[1]) for ip in params['ips']
+                        if (':' in ip) == (':' in gateway)])]
+    if 'interfaces' in params:
+        intf = params['interfaces'].get('%s-eth%d' % (name, port), [])
+        configs = intf if isinstance(intf, list) else [intf]
+        return [(config.get('vlan'), [gatewayAddress(address, gateways)
+                                      for address in config.get('ipAddrs', [])])
+                for config in configs]
+    return [(vlan, list(matchSubnets(subnets, name, switch)))]
+
+def sortIps(ips):
+    """Puts IPv4 addresses before IPv6 ones, as the Trellis netcfgs do."""
+    return sorted(ips, key=lambda ip: ':' in ip)
+
+class FabricPort(object):
+
+    """Internal data structure storing what is attached to a fabric port."""
+
+    def __init__(self, switch, port):
+        self.switch = switch
+        self.port = port
+        self.ips = []
+        self.untagged = None
+        self.tagged = []
+
+    def addIps(self, ips):
+        for ip in ips:
+            if ip not in self.ips:
+                self.ips.append(ip)
+
+class FabricWalk(object):
+
+    """A single pass over the ports of a Topo's fabric switches, collecting
+    the edge ports, pair links, DHCP servers and static hosts."""
+
+    def __init__(self, topo, subnets={}, vlans={}, firstVlan=10, vlanStep=10):
+        self.topo = topo
+        self.subnets = subnets
+        self.vlans = dict(vlans)
+        self.nextVlan = max([firstVlan] + [vlan + vlanStep for vlan in vlans.values()])
+        self.vlanStep = vlanStep
+        # Fabric addresses of subnets, by the address of a router on them
+        self.gateways = {}
+
+        # Only the fabric switches are sorted, not every node
+        self.switches = sorted((n for n in topo.nodes(sort=False) if topo.isSwitch(n) and
+                                not isSubclass(topo.nodeInfo(n), OVSBridge)), key=natural)
+        self.fabric = set(self.switches)
+        self.ids = dict((s, deviceId(s, topo.nodeInfo(s))) for s in self.switches)
+
+        # Edge ports of each switch, and the fabric switches each links to
+        # as (peer, local port)
+        self.edgePorts = dict((s, []) for s in self.switches)
+        self.fabricLinks = dict((s, []) for s in self.switches)
+        # (connect point, server addresses) of every DHCP server
+        self.dhcpServers = []
+        # Static host key to host config
+        self.hosts = {}
+
+        for switch in self.switches:
+            ports = topo.ports.get(switch, {})
+            for port in sorted(ports):
+                node, nodePort = ports[port]
+                if node in self.fabric:
+                    self.fabricLinks[switch].append((node, port))
+                else:
+                    fabricPort = FabricPort(switch, port)
+                    self.attach(fabricPort, node, nodePort, set([switch]))
+                    if fabricPort.ips or fabricPort.tagged:
+                        self.edgePorts[switch].append(fabricPort)
+
+    def vlanFor(self, ip):
+        if ip not in self.vlans:
+            self.vlans[ip] = self.nextVlan
+            self.nextVlan += self.vlanStep
+        return self.vlans[ip]
+
+    def connectPoint(self, fabricPort):
+        return '%s/%s' % (self.ids[fabricPort.switch], fabricPort.port)
+
+    def attach(self, fabricPort, node, nodePort, visited):
+        """Adds a node, and everything behind it if it is a bridge, to a
+        fabric port."""
+        visited.add(node)
+        params = self.topo.nodeInfo(node)
+        if self.topo.isSwitch(node):
+            ports = self.topo.ports.get(node, {})
+            for port in sorted(ports):
+                neighbor, neighborPort = ports[port]
+                # The walk stops at the fabric, e.g. for a bridge on two leaves
+                if neighbor not in visited and neighbor not in self.fabric:
+                    self.attach(fabricPort, neighbor, neighborPort, visited)
+            return
+
+        for vlan, ips in nodeSubnets(node, params, nodePort, fabricPort.switch,
+                                     self.subnets, self.gateways):
+            ips = sortIps(ips)
+            fabricPort.addIps(ips)
+            if vlan is not None:
+                vlan = int(vlan)
+                for ip in ips:
+                    self.vlans.setdefault(ip, vlan)
+                if vlan not in fabricPort.tagged:
+                    fabricPort.tagged.append(vlan)
+            elif ips and fabricPort.untagged is None:
+                fabricPort.untagged = self.vlanFor(ips[0])
+
+        addresses = [ip.split('/')[0] for ip in params.get('ips', [])]
+        if isSubclass(params, (DhcpServer, Dhcp6Server)):
+            self.dhcpServers.append((self.connectPoint(fabricPort), addresses))
+        elif addresses and 'mac' in params and 'interfaces' not in params:
+            key = '%s/%s' % (params['mac'], params.get('vlan', 'None'))
+            host = self.hosts.setdefault(key, {'basic': {'ips': addresses, 'locations': []}})
+            host['basic']['locations'].append(self.connectPoint(fabricPort))
+
+    def pairs(self):
+        """Returns the paired leaf and local pair port of every leaf with a
+        direct link to another leaf."""
+        pairs = {}
+        for switch in self.switches:
+            if not self.edgePorts[switch]:
+                continue
+            for peer, port in self.fabricLinks[switch]:
+                if self.edgePorts[peer]:
+                    pairs[switch] = (peer, port)
+                    break
+        return pairs
+
+def portEntries(walk):
+    # Ports with the same subnets and VLANs share one config
+    configs = {}
+    for switch in walk.switches:
+        for fabricPort in walk.edgePorts[switch]:
+            ips = sortIps(fabricPort.ips)
+            key = (tuple(ips), fabricPort.untagged, tuple(fabricPort.tagged))
+            if key not in configs:
+                interface = {'ips': ips}
+                if fabricPort.tagged:
+                    interface['vlan-tagged'] = fabricPort.tagged
+                    # A port with tagged VLANs takes untagged traffic on
+                    # its native VLAN
+                    if fabricPort.untagged is not None:
+                        interface['vlan-native'] = fabricPort.untagged
+                elif fabricPort.untagged is not None:
+                    interface['vlan-untagged'] = fabricPort.untagged
+                configs[key] = {'interfaces': [interface]}
+            yield walk.connectPoint(fabricPort), configs[key]
+
+def pairPortEntries(walk, pairs):
+    """Yields the pair link ports, which carry the VLANs of the subnets that
+    both leaves of a pair have edge ports on, e.g. of dual-homed hosts."""
+    for switch in walk.switches:
+        if switch not in pairs:
+            continue
+        peer, port = pairs[switch]
+        peerIps = set(ip for fabricPort in walk.edgePorts[peer] for ip in fabricPort.ips)
+        pairPort = FabricPort(switch, port)
+        for fabricPort in walk.edgePorts[switch]:
+            for ip in fabricPort.ips:
+                if ip in peerIps:
+                    pairPort.addIps([ip])
+                    vlan = walk.vlans.get(ip, fabricPort.untagged)
+                    if vlan not in pairPort.tagged:
+                        pairPort.tagged.append(vlan)
+        if pairPort.ips:
+            yield walk.connectPoint(pairPort), \
+                {'interfaces': [{'ips': sortIps(pairPort.ips),
+                                 'vlan-tagged': sorted(pairPort.tagged)}]}
+
+def routerMac(dpid):
+    hexDpid = dpid[-12:]
+    return ':'.join(hexDpid[i:i + 2] for i in range(0, 12, 2))
+
+def loopbacks(sid):
+    """Returns the IPv4 and IPv6 loopbacks of a node SID, 192.168.0.<sid>
+    and 2000::c0a8:<sid> as in the Trellis netcfgs."""
+    v4 = (192 << 24) + (168 << 16) + sid
+    ipv4 = '%d.%d.%d.%d' % (v4 >> 24, (v4 >> 16) & 0xff, (v4 >> 8) & 0xff, v4 & 0xff)
+    ipv6 = '2000::c0a8:%04d' % sid if sid < 10000 else '2000::%x:%x' % (v4 >> 16, v4 & 0xffff)
+    return ipv4, ipv6
+
+def deviceEntries(walk, pairs, driver='ofdpa-ovs', ipv6=True):
+    sids = dict((s, nodeSid(s, walk.topo.nodeInfo(s))) for s in walk.switches)
+    # IPv6 SIDs are the IPv4 ones plus 10, or more if that would collide
+    offset = 10
+    while ipv6 and set(sids.values()) & set(sid + offset for sid in sids.values()):
+        offset *= 10
+
+    for switch in walk.switches:
+        sid = sids[switch]
+        dpid = walk.ids[switch]
+        ipv4Loopback, ipv6Loopback = loopbacks(sid)
+        segmentRouting = {'name': switch,
+                          'ipv4NodeSid': sid,
+                          'ipv4Loopback': ipv4Loopback,
+                          'routerMac': routerMac(dpid),
+                          'isEdgeRouter': bool(walk.edgePorts[switch]),
+                          'adjacencySids': []}
+        if ipv6:
+            segmentRouting['ipv6NodeSid'] = sid + offset
+            segmentRouting['ipv6Loopback'] = ipv6Loopback
+        if switch in pairs:
+            peer, port = pairs[switch]
+            # Both leaves of a pair share the router MAC of the first one
+            segmentRouting['routerMac'] = routerMac(min(dpid, walk.ids[peer]))
+            segmentRouting['pairDeviceId'] = walk.ids[peer]
+            segmentRouting['pairLocalPort'] = port
+        yield dpid, {'segmentrouting': segmentRouting,
+                     'basic': {'name': switch, 'driver': driver}}
+
+def appEntries(walk):
+    if walk.dhcpServers:
+        relays = []
+        for connectPoint, addresses in walk.dhcpServers:
+            # Servers behind the same port share one relay entry
+            for relay in relays:
+                if relay['dhcpServerConnectPoint'] == connectPoint:
+                    relay['serverIps'].extend(addresses)
+                    break
+            else:
+                relays.append({'dhcpServerConnectPoint': connectPoint,
+                               'serverIps': list(addresses)})
+        yield 'org.onosproject.dhcprelay', {'default': relays}
+
+def netcfgSections(topo, subnets={}, vlans={}, firstVlan=10, driver='ofdpa-ovs', ipv6=True):
+    """Returns the netcfg of a topology as a list of (section, entries)
+    pairs, where entries yields the (key, config) pairs of the section.
+    Sections that turn out to have no entries are left out of the netcfg.
+
+    subnets gives the fabric addresses on the subnets of hosts that have no
+    addressing of their own, keyed by host name or by fnmatch pattern of
+    'host@switch'; it can also be a function of (host, switch). vlans gives
+    the untagged VLANs of subnets, by fabric address."""
+    walk = FabricWalk(topo, subnets, vlans, firstVlan)
+    pairs = walk.pairs()
+
+    def ports():
+        for entry in portEntries(walk):
+            yield entry
+        for entry in pairPortEntries(walk, pairs):
+            yield entry
+
+    return [('ports', ports()),
+            ('devices', deviceEntries(walk, pairs, driver, ipv6)),
+            ('hosts', sorted(walk.hosts.items())),
+            ('apps', appEntries(walk))]
+
+def compileNetcfg(topo, **kwargs):
+    """Returns the netcfg of a topology as a dict."""
+    netcfg = dict((section, dict(entries))
+                  for section, entries in netcfgSections(topo, **kwargs))
+    return dict((section, entries) for section, entries in netcfg.items() if entries)
+
+def writeNetcfg(sections, filename):
+    """Writes netcfg sections out as a JSON document, an entry at a time,
+    leaving out sections without entries. The file is replaced once
+    complete."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmpName = tempfile.mkstemp(dir=directory, prefix='.netcfg.')
+    entries = 0
+    # One encoder for all entries; sort_keys would rule out the C encoder
+    encode = json.JSONEncoder().encode
+    with os.fdopen(fd, 'w') as f:
+        f.write('{')
+        sectionSeparator = ''
+        for section, sectionEntries in sections:
+            # The section is opened on its first entry
+            separator = None
+            for key, config in sectionEntries:
+                if separator is None:
+                    f.write('%s\n  %s: {' % (sectionSeparator, encode(section)))
+                    sectionSeparator = ','
+                    separator = ''
+                f.write('%s\n    %s: %s' % (separator, encode(key), encode(config)))
+                separator = ','
+                entries += 1
+            if separator is not None:
+                f.write('\n  }')
+        f.write('\n}\n')
+    os.rename(tmpName, filename)
+    info('*** Wrote netcfg of %i entries to %s\n' % (entries, filename))
+
+def topologyModule(filename):
+    """Imports a Python topology file. Returns its topology, the first of
+    its topos, and its netcfg parameters, from its netcfg dict if it has
+    one."""
+    # Imported here as only the command line takes Python topologies
+    import imp
+    name = os.path.splitext(os.path.basename(filename))[0]
+    module = imp.load_source(name, filename)
+    return module.topos.values()[0](), getattr(module, 'netcfg', {})
+
+def checkNetcfg(netcfg, filename):
+    """Compares a netcfg with the one in a file, logging the configs that
+    differ. Returns True if they are the same."""
+    # Imported here as onosrestlib is only needed for the comparison
+    from onosrestlib import diffNetcfg
+    with open(filename) as f:
+        expected = json.load(f)
+    # Round-trip through JSON, so that tuples and unicode compare equal
+    netcfg = json.loads(json.dumps(netcfg))
+    missing, _ = diffNetcfg(netcfg, expected)
+    unexpected, _ = diffNetcfg(expected, netcfg)
+    for label, configs in [('expected', missing), ('generated', unexpected)]:
+        for subjectClass, subjects in sorted(configs.items()):
+            for subject, subjectConfigs in sorted(subjects.items()):
+                info('*** %s %s/%s: %s\n' % (label, subjectClass, subject,
+                                             json.dumps(subjectConfigs, sort_keys=True)))
+    return not missing and not unexpected
+
+if __name__ == '__main__':
+    import argparse
+    from mininet.log import setLogLevel
+    from speclib import loadSpec, specTopo, parseVars, expand, DEFAULT_CACHE_DIR
+
+    parser = argparse.ArgumentParser(description='Generates the netcfg of a topology')
+    parser.add_argument('topology', help='topology spec file, or Python topology file '
+                        'whose netcfg dict holds the netcfg parameters')
+    parser.add_argument('output', nargs='?', help='netcfg file to write')
+    parser.add_argument('--var', action='append', default=[], help='override a spec var, as name=value')
+    parser.add_argument('--check', metavar='NETCFG',
+                        help='compare the generated netcfg with this netcfg file')
+    args = parser.parse_args()
+    if args.output is None and args.check is None:
+        parser.error('an output file or --check is needed')
+
+    setLogLevel('info')
+    if args.topology.endswith('.py'):
+        topo, params = topologyModule(args.topology)
+    else:
+        spec = loadSpec(args.topology)
+        overrides = parseVars(args.var)
+        topo = specTopo(args.topology, overrides, DEFAULT_CACHE_DIR)
+        params = expand(spec.get('netcfg', {}), dict(spec.get('vars', {}), **overrides))
+    if args.output:
+        writeNetcfg(netcfgSections(topo, **params), args.output)
+    if args.check:
+        if not checkNetcfg(compileNetcfg(topo, **params), args.check):
+            info('*** The netcfg of %s differs from %s\n' % (args.topology, args.check))
+            sys.exit(1)
+        info('*** The netcfg of %s matches %s\n' % (args.topology, args.check))
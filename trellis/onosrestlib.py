@@ -0,0 +1,314 @@
+#!/usr/bin/python
+
+"""
+Libraries for configuring ONOS through its REST API.
+
+NetcfgSync keeps the netcfg of an ONOS cluster in step with a desired
+netcfg by sending only what differs, instead of uploading the whole netcfg
+(and having the fabric reprogrammed) on every start:
+
+    sync = NetcfgSync(OnosRestClient('10.0.0.1'))
+    sync.push(json.load(open('trellis.json')))
+
+A netcfg is compared config by config, a config being the value of one
+config key (e.g. segmentrouting) of one subject (e.g. a device) of one
+subject class (e.g. devices), which is the unit ONOS replaces configs in.
+Added and changed configs go out in one POST, removed ones as a DELETE each.
+
+NetcfgBatcher sends netcfg fragments that trickle in, such as those of
+switches registering themselves as they start, from a background thread,
+merged into as few POSTs as possible.
+"""
+
+import sys
+sys.path.append('..')
+from mininet.log import info, debug, warn
+from startuplib import percentile
+from threading import Thread, Condition
+import base64
+import httplib
+import json
+import os
+import socket
+import tempfile
+import time
+import urllib
+
+DEFAULT_STATE_DIR = os.path.expanduser('~/.cache/routing-topo')
+
+class OnosRestClient(object):
+
+    """Client of the REST API of one ONOS instance. A single HTTP connection
+    is kept alive across requests, and reopened if the server closes it.
+    Requests that fail on the connection or with a server error are retried
+    up to retries times, backing off exponentially. The latency of every
+    request is recorded in requests."""
+
+    def __init__(self, host, port=8181, user=None, password=None, timeout=10,
+                 retries=3, backoff=0.5):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        user = user or os.environ.get('ONOS_WEB_USER', 'onos')
+        password = password or os.environ.get('ONOS_WEB_PASS', 'rocks')
+        self.auth = 'Basic %s' % base64.b64encode('%s:%s' % (user, password))
+        self.connection = None
+
+        # (method, path, status, seconds, attempts) of every request
+        self.requests = []
+
+    def send(self, method, path, body, headers):
+        if self.connection is None:
+            self.connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self.connection.request(method, '/onos/v1' + path, body, headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (httplib.HTTPException, socket.error):
+            self.close()
+            raise
+
+    def request(self, method, path, data=None):
+        """Sends a request to a path under /onos/v1, with data encoded as
+        JSON. Returns the response body."""
+        body = None if data is None else json.dumps(data)
+        headers = {'Authorization': self.auth, 'Accept': 'application/json'}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+
+        start = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                status, result = self.send(method, path, body, headers)
+                if status < 500:
+                    break
+                error = '%s %s' % (status, result)
+            except (httplib.HTTPException, socket.error) as e:
+                # A kept-alive connection closed by the server fails at
+                # once, so the first retry doesn't wait
+                status, error = None, e
+            if attempt > self.retries:
+                break
+            delay = self.backoff * 2 ** (attempt - 2) if attempt > 1 else 0
+            debug('*** ONOS %s %s failed (%s), retrying in %.1fs\n' % (method, path, error, delay))
+            time.sleep(delay)
+
+        elapsed = time.time() - start
+        self.requests.append((method, path, status, elapsed, attempt))
+        debug('*** ONOS %s %s: %s in %.3fs (%i bytes sent)\n'
+              % (method, path, status, elapsed, len(body or '')))
+        if status is None or status >= 300:
+            raise Exception('ONOS %s %s failed after %i attempts: %s'
+                            % (method, path, attempt, error if status is None else
+                               '%s %s' % (status, result)))
+        return result
+
+    def getJson(self, path):
+        return json.loads(self.request('GET', path) or '{}')
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def printReport(self):
+        if not self.requests:
+            return
+        latencies = [elapsed for _, _, _, elapsed, _ in self.requests]
+        retried = len([attempts for _, _, _, _, attempts in self.requests if attempts > 1])
+        info('*** %i ONOS requests to %s (%i retried): p50 %.3fs p99 %.3fs max %.3fs\n'
+             % (len(latencies), self.host, retried, percentile(latencies, 50),
+                percentile(latencies, 99), max(latencies)))
+
+def diffNetcfg(old, new):
+    """Compares two netcfgs config by config. Returns a netcfg of the
+    configs that are new or changed in new, and the paths of the configs of
+    old that new doesn't have: (subject class, subject) where a subject has
+    gone entirely, else (subject class, subject, config key)."""
+    changes = {}
+    for subjectClass, subjects in new.items():
+        oldSubjects = old.get(subjectClass, {})
+        for subject, configs in subjects.items():
+            oldConfigs = oldSubjects.get(subject, {})
+            for configKey, config in configs.items():
+                if oldConfigs.get(configKey) != config:
+                    changes.setdefault(subjectClass, {}).setdefault(subject, {})[configKey] = config
+
+    removals = []
+    for subjectClass, subjects in old.items():
+        newSubjects = new.get(subjectClass, {})
+        for subject, configs in subjects.items():
+            if subject not in newSubjects:
+                removals.append((subjectClass, subject))
+            else:
+                removals.extend((subjectClass, subject, configKey) for configKey in configs
+                                if configKey not in newSubjects[subject])
+    return changes, removals
+
+def hasPath(netcfg, path):
+    for key in path:
+        if not isinstance(netcfg, dict) or key not in netcfg:
+            return False
+        netcfg = netcfg[key]
+    return True
+
+def countConfigs(netcfg):
+    return sum(len(configs) for subjects in netcfg.values() for configs in subjects.values())
+
+class NetcfgSync(object):
+
+    """Pushes netcfgs to ONOS as deltas. The last netcfg pushed is kept in
+    stateFile; it tells which configs were ours, and so may be removed when
+    they are no longer wanted. Changes are worked out against the live
+    netcfg, read from ONOS, so a restarted cluster is brought back in step;
+    with trustState they are worked out against the last netcfg pushed
+    instead, saving that read."""
+
+    def __init__(self, client, stateFile=None, trustState=False):
+        self.client = client
+        self.stateFile = stateFile or os.path.join(
+            DEFAULT_STATE_DIR, 'netcfg-%s-%s.json' % (client.host, client.port))
+        self.trustState = trustState
+
+    def loadState(self):
+        if not os.path.exists(self.stateFile):
+            return None
+        with open(self.stateFile) as f:
+            return json.load(f)
+
+    def saveState(self, netcfg):
+        directory = os.path.dirname(self.stateFile)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmpName = tempfile.mkstemp(dir=directory, prefix='.netcfg.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(netcfg, f)
+        os.rename(tmpName, self.stateFile)
+
+    def push(self, netcfg):
+        """Brings the cluster's netcfg in step with netcfg. Returns the
+        changes and removals sent."""
+        pushed = self.loadState()
+        if self.trustState and pushed is not None:
+            current = pushed
+        else:
+            current = self.client.getJson('/network/configuration')
+
+        changes, _ = diffNetcfg(current, netcfg)
+        _, removals = diffNetcfg(pushed or {}, netcfg)
+        # Configs removed by someone else are left alone
+        removals = [path for path in removals if hasPath(current, path)]
+
+        if changes:
+            self.client.request('POST', '/network/configuration', changes)
+        for path in removals:
+            self.client.request('DELETE', '/network/configuration/%s'
+                                % '/'.join(urllib.quote(key, safe='') for key in path))
+        self.saveState(netcfg)
+
+        info('*** netcfg: %i of %i configs changed, %i removed\n'
+             % (countConfigs(changes), countConfigs(netcfg), len(removals)))
+        return changes, removals
+
+def mergeNetcfg(netcfg, fragment):
+    """Merges a netcfg fragment into netcfg, config by config."""
+    for subjectClass, subjects in fragment.items():
+        for subject, configs in subjects.items():
+            netcfg.setdefault(subjectClass, {}).setdefault(subject, {}).update(configs)
+
+class NetcfgBatcher(object):
+
+    """Sends netcfg fragments to ONOS from a background thread. Fragments
+    are merged and sent in one POST once none have been added for linger
+    seconds, or once maxConfigs configs are waiting, so that whoever adds
+    them never waits on ONOS."""
+
+    def __init__(self, client, linger=0.2, maxConfigs=500):
+        self.client = client
+        self.linger = linger
+        self.maxConfigs = maxConfigs
+
+        self.condition = Condition()
+        self.pending = {}
+        self.lastAdded = None
+        self.closing = False
+        self.thread = None
+
+        self.configsSent = 0
+        self.configsFailed = 0
+
+    def add(self, fragment):
+        with self.condition:
+            mergeNetcfg(self.pending, fragment)
+            self.lastAdded = time.time()
+            if self.thread is None:
+                self.thread = Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+
+    def nextBatch(self):
+        """Waits for a batch to be due, and takes it. Returns None once
+        closed with nothing left to send."""
+        with self.condition:
+            while True:
+                if self.pending:
+                    wait = self.lastAdded + self.linger - time.time()
+                    if self.closing or wait <= 0 or countConfigs(self.pending) >= self.maxConfigs:
+                        batch, self.pending = self.pending, {}
+                        return batch
+                    self.condition.wait(wait)
+                elif self.closing:
+                    return None
+                else:
+                    self.condition.wait()
+
+    def run(self):
+        while True:
+            batch = self.nextBatch()
+            if batch is None:
+                break
+            try:
+                self.client.request('POST', '/network/configuration', batch)
+                self.configsSent += countConfigs(batch)
+            except Exception as e:
+                warn('*** Unable to push netcfg to ONOS: %s\n' % e)
+                self.configsFailed += countConfigs(batch)
+
+    def close(self):
+        """Sends whatever is left and waits for the background thread."""
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.client.close()
+        info('*** Pushed %i netcfg configs to ONOS%s\n'
+             % (self.configsSent, ', %i failed' % self.configsFailed if self.configsFailed else ''))
+        self.client.printReport()
+
+if __name__ == '__main__':
+    import argparse
+    from mininet.log import setLogLevel
+
+    parser = argparse.ArgumentParser(description='Pushes the changes between a netcfg and the one ONOS has')
+    parser.add_argument('controller', help='ONOS controller, or comma separated list of controllers')
+    parser.add_argument('netcfg', help='netcfg file')
+    parser.add_argument('--state', help='file the last pushed netcfg is kept in')
+    parser.add_argument('--trust-state', action='store_true',
+                        help="work changes out against the last pushed netcfg, without reading ONOS's")
+    parser.add_argument('--full', action='store_true', help='push the whole netcfg')
+    args = parser.parse_args()
+
+    setLogLevel('info')
+    with open(args.netcfg) as f:
+        netcfg = json.load(f)
+    client = OnosRestClient(args.controller.split(',')[0])
+    if args.full:
+        client.request('POST', '/network/configuration', netcfg)
+    else:
+        NetcfgSync(client, args.state, args.trust_state).push(netcfg)
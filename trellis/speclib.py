@@ -0,0 +1,242 @@
+#!/usr/bin/python
+
+"""
+Libraries for describing topologies declaratively.
+
+A topology spec is a JSON (or, with PyYAML installed, YAML) document that
+lists the switches, hosts and links of a topology, with node classes given
+by name (any node class of Mininet, routinglib or trellislib). Groups of
+similar hosts are generated from one entry, and vars parameterize the whole
+spec, so one spec file can describe many scenario variants:
+
+    {
+      "vars": {"hostsPerLeaf": 2},
+      "switches": {"s204": {"dpid": "204"}, "s205": {"dpid": "205"}},
+      "hosts": {"dhcp": {"cls": "DhcpServer", "ips": ["10.0.3.253/24"],
+                         "gateway": "10.0.3.254"}},
+      "groups": [{"name": "h{i}", "count": "{hostsPerLeaf}",
+                  "cls": "DhcpClient", "mac": "00:aa:00:00:00:{i:02x}",
+                  "link": "s204"}],
+      "links": [["s204", "s205"], ["dhcp", "s205"]]
+    }
+
+Strings containing {...} are formatted with the vars and, in groups, the
+index i of the generated host. As link order decides port numbers, the
+links of a group can be placed in the link list with "group:<id>" (a
+group's id defaults to its name). A "fabric" section generates a whole
+leaf-spine fabric, taking the parameters of fabriclib.fabricGraph(). A
+spec is compiled into a flat list of nodes and links, which is cached on
+disk under the hash of the spec and its vars, so a big fabric is only ever
+expanded once. A "netcfg" section holds the parameters of
+netcfglib.netcfgSections(), for writing the matching ONOS netcfg.
+"""
+
+import sys
+sys.path.append('..')
+from mininet.topo import Topo
+from mininet.log import info, debug
+import mininet.node
+import routinglib
+import trellislib
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import tempfile
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+DEFAULT_CACHE_DIR = os.path.expanduser('~/.cache/routing-topo')
+
+# Bumped whenever the compiled form changes, to invalidate cached ones
+COMPILED_VERSION = 2
+
+# Modules node classes are looked up in, in order
+CLASS_MODULES = [trellislib, routinglib, mininet.node]
+
+def loadSpec(filename):
+    """Reads a topology spec from a JSON or YAML file."""
+    with open(filename) as f:
+        if filename.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise Exception('PyYAML is needed to read %s' % filename)
+            return yaml.safe_load(f)
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+def specHash(spec, overrides={}):
+    """Returns a hash of the spec and the vars it is compiled with."""
+    # The order of the spec matters, so its keys aren't sorted
+    canonical = json.dumps([COMPILED_VERSION, spec, sorted(overrides.items())])
+    return hashlib.sha1(canonical).hexdigest()
+
+def expand(value, context):
+    """Formats every string within value with context. A string that is
+    just '{name}' is replaced by the value itself, keeping its type."""
+    if isinstance(value, basestring):
+        if value.startswith('{') and value.endswith('}') and value[1:-1] in context:
+            return context[value[1:-1]]
+        return value.format(**context) if '{' in value else value
+    if isinstance(value, list):
+        return [expand(item, context) for item in value]
+    if isinstance(value, dict):
+        return value.__class__((key, expand(item, context)) for key, item in value.items())
+    return value
+
+def compileSpec(spec, overrides={}):
+    """Compiles a spec into a dict of 'switches', 'hosts' and 'links', each a
+    list in the order the nodes and links are to be added."""
+    context = dict(spec.get('vars', {}), **overrides)
+
+    switches = []
+    hosts = []
+    links = []
+
+    if 'fabric' in spec:
+        # Imported here as fabriclib builds on this module
+        from fabriclib import fabricGraph
+        fabric = fabricGraph(**expand(spec['fabric'], context))
+        switches.extend(fabric['switches'])
+        hosts.extend(fabric['hosts'])
+        links.extend(fabric['links'])
+
+    switches.extend((name, expand(params, context))
+                    for name, params in spec.get('switches', {}).items())
+    hosts.extend((name, expand(params, context))
+                 for name, params in spec.get('hosts', {}).items())
+    groupLinks = OrderedDict()
+
+    for group in spec.get('groups', []):
+        group = dict(group)
+        groupId = group.pop('id', group['name'])
+        groupLinks[groupId] = []
+        start = int(expand(group.pop('start', 1), context))
+        count = int(expand(group.pop('count'), context))
+        nameFormat = group.pop('name')
+        link = group.pop('link', None)
+
+        for i in range(start, start + count):
+            groupContext = dict(context, i=i)
+            name = expand(nameFormat, groupContext)
+            hosts.append((name, expand(group, groupContext)))
+            if link is not None:
+                # A list of switches is cycled through, spreading the hosts
+                target = link[(i - start) % len(link)] if isinstance(link, list) else link
+                groupLinks[groupId].append([name, expand(target, groupContext), {}])
+
+    # Links are added in the order they are listed, as that decides port
+    # numbers. 'group:<id>' places the links of a group; the links of groups
+    # that aren't placed come last. The fabric's links have fixed ports and
+    # go first.
+    for link in spec.get('links', []):
+        if isinstance(link, basestring) and link.startswith('group:'):
+            links.extend(groupLinks.pop(link[len('group:'):]))
+        elif isinstance(link, dict):
+            link = dict(link)
+            links.append([expand(link.pop('node1'), context), expand(link.pop('node2'), context),
+                          expand(link, context)])
+        else:
+            params = link[2] if len(link) > 2 else {}
+            links.append([expand(link[0], context), expand(link[1], context),
+                          expand(params, context)])
+    for remaining in groupLinks.values():
+        links.extend(remaining)
+
+    return {'switches': switches, 'hosts': hosts, 'links': links}
+
+def cachedCompile(spec, overrides={}, cacheDir=DEFAULT_CACHE_DIR):
+    """Compiles a spec, or reads its compiled form from the cache."""
+    cacheFile = os.path.join(cacheDir, '%s.json' % specHash(spec, overrides))
+    if os.path.exists(cacheFile):
+        debug('*** Using compiled topology %s\n' % cacheFile)
+        with open(cacheFile) as f:
+            return json.load(f)
+
+    compiled = compileSpec(spec, overrides)
+    if not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+    fd, tmpName = tempfile.mkstemp(dir=cacheDir, prefix='.compiled.')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(compiled, f)
+    os.rename(tmpName, cacheFile)
+    debug('*** Cached compiled topology in %s\n' % cacheFile)
+    return compiled
+
+def nodeClass(name):
+    for module in CLASS_MODULES:
+        if hasattr(module, name):
+            return getattr(module, name)
+    raise Exception('Unknown node class %s' % name)
+
+def resolveParams(params):
+    params = dict(params)
+    if 'cls' in params:
+        params['cls'] = nodeClass(params['cls'])
+    return params
+
+class SpecTopo(Topo):
+
+    """Topology built from a compiled topology spec."""
+
+    def build(self, compiled):
+        for name, params in compiled['switches']:
+            self.addSwitch(str(name), **resolveParams(params))
+        for name, params in compiled['hosts']:
+            self.addHost(str(name), **resolveParams(params))
+        for node1, node2, params in compiled['links']:
+            self.addLink(str(node1), str(node2), **params)
+
+def specTopo(filename, overrides={}, cacheDir=DEFAULT_CACHE_DIR):
+    """Builds the Topo described by a spec file."""
+    spec = loadSpec(filename)
+    compiled = cachedCompile(spec, overrides, cacheDir) if cacheDir else compileSpec(spec, overrides)
+    info('*** Topology %s: %i switches, %i hosts, %i links\n'
+         % (filename, len(compiled['switches']), len(compiled['hosts']), len(compiled['links'])))
+    return SpecTopo(compiled)
+
+def parseVars(assignments):
+    """Parses name=value pairs, reading values as JSON where possible."""
+    overrides = {}
+    for assignment in assignments:
+        name, value = assignment.split('=', 1)
+        try:
+            overrides[name] = json.loads(value)
+        except ValueError:
+            overrides[name] = value
+    return overrides
+
+if __name__ == '__main__':
+    import argparse
+    from functools import partial
+    from mininet.log import setLogLevel
+    from mininet.node import OVSSwitch
+    from routinglib import RoutingCli
+
+    parser = argparse.ArgumentParser(description='Runs a topology spec', add_help=False)
+    parser.add_argument('spec', help='topology spec file')
+    parser.add_argument('--var', action='append', default=[], help='override a spec var, as name=value')
+    parser.add_argument('--no-cache', action='store_true', help="don't cache the compiled topology")
+    parser.add_argument('--netcfg', help='write the netcfg of the topology to this file')
+    args, rest = parser.parse_known_args()
+    sys.argv = sys.argv[:1] + rest
+
+    setLogLevel('debug')
+    spec = loadSpec(args.spec)
+    arguments = trellislib.parse_trellis_args()
+    if spec.get('zebra', False):
+        trellislib.set_up_zebra_config(arguments.controllers)
+
+    overrides = parseVars(args.var)
+    topo = specTopo(args.spec, overrides, None if args.no_cache else DEFAULT_CACHE_DIR)
+    if args.netcfg:
+        from netcfglib import netcfgSections, writeNetcfg
+        netcfgParams = expand(spec.get('netcfg', {}), dict(spec.get('vars', {}), **overrides))
+        writeNetcfg(netcfgSections(topo, **netcfgParams), args.netcfg)
+    switch = partial(OVSSwitch, **spec.get('switch', {'protocols': 'OpenFlow13', 'datapath': 'user'}))
+    net = trellislib.get_mininet(arguments, topo, switch)
+
+    net.start()
+    RoutingCli(net)
+    net.stop()
@@ -174,6 +174,14 @@ class Trellis( Topo ):
 
 topos = { 'trellis' : Trellis }
 
+# Fabric addresses and VLANs of the subnets of the DHCP clients, for
+# netcfglib to generate trellis_dualhome.json from the topology
+netcfg = { 'subnets': { 'h?@s204': ['10.0.2.254/24'], 'h?@s205': ['10.0.3.254/24'],
+                        'h?v6@s204': ['2000::2ff/120'], 'h?v6@s205': ['2000::3ff/120'],
+                        'dh1': ['10.1.2.254/24', '2001::2ff/120'] },
+           'vlans': { '10.0.2.254/24': 20, '10.1.2.254/24': 21, '10.0.3.254/24': 30,
+                      '2000::2ff/120': 40, '2000::3ff/120': 50 } }
+
 if __name__ == "__main__":
     setLogLevel('debug')
     topo = Trellis()
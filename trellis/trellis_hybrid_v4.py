@@ -1,10 +1,7 @@
 #!/usr/bin/python
 import argparse
 import sys
-import os
-import json
 import random
-import urllib2
 sys.path.append('..')
 from mininet.topo import Topo
 from mininet.cli import CLI
@@ -16,6 +13,7 @@ from routinglib import RoutedHost, UserNAT
 from trellislib import DhcpClient, DhcpServer
 from trellislib import DualHomedDhcpClient
 from trellislib import get_mininet, set_up_zebra_config
+from onosrestlib import OnosRestClient, NetcfgBatcher
 from functools import partial
 
 PIPECONF_ID = 'org.onosproject.pipelines.fabric'
@@ -204,10 +202,13 @@ topos = { 'trellis' : Trellis }
 class ONOSOVSSwitch( OVSSwitch ):
     """OVSSwitch that generates and pushes config to ONOS"""
 
+    # Netcfg batchers of the ONOS clusters switches have registered with,
+    # by controller list
+    batchers = {}
+
     def __init__(self, name, netcfg=True, **kwargs):
         OVSSwitch.__init__(self, name, **kwargs)
         self.netcfg = netcfg in (True, '1', 'true', 'True')
-        self.netcfgfile = '/tmp/ovs-%s-netcfg.json' % self.name
         self.onosDeviceId = 'of:%s' % self.dpid
         self.longitude = kwargs['longitude'] if 'longitude' in kwargs else None
         self.latitude = kwargs['latitude'] if 'latitude' in kwargs else None
@@ -221,9 +222,27 @@ class ONOSOVSSwitch( OVSSwitch ):
         assert len(clist) > 0
         return random.choice(clist).IP()
 
+    @classmethod
+    def batcher(cls, controllers):
+        """Returns the netcfg batcher of a cluster, which sends the configs
+        of all its switches over one connection to one of its controllers."""
+        key = tuple(controllers)
+        if key not in cls.batchers:
+            cls.batchers[key] = NetcfgBatcher(OnosRestClient(cls.controllerIp(controllers)))
+        return cls.batchers[key]
+
+    @classmethod
+    def waitForNetcfg(cls):
+        """Waits for the configs of all started switches to be pushed."""
+        for batcher in cls.batchers.values():
+            batcher.close()
+        cls.batchers = {}
+
     def start(self, controllers):
         """
         Starts the switch, then notifies ONOS about the new device via Netcfg.
+        The config is sent in the background, together with those of the
+        other switches.
         """
         OVSSwitch.start(self, controllers)
 
@@ -231,8 +250,6 @@ class ONOSOVSSwitch( OVSSwitch ):
             # Do not push config to ONOS.
             return
 
-        controllerIP = self.controllerIp(controllers)
-
         basicCfg = {
             "name": self.name,
             "driver": "ofdpa-ovs"
@@ -247,26 +264,7 @@ class ONOSOVSSwitch( OVSSwitch ):
                 self.onosDeviceId: { "basic": basicCfg }
             }
         }
-        with open(self.netcfgfile, 'w') as fp:
-            json.dump(cfgData, fp, indent=4)
-
-        # Build netcfg URL
-        url = 'http://%s:8181/onos/v1/network/configuration/' % controllerIP
-        # Instantiate password manager for HTTP auth
-        pm = urllib2.HTTPPasswordMgrWithDefaultRealm()
-        user = os.environ['ONOS_WEB_USER'] if 'ONOS_WEB_USER' in os.environ else 'onos'
-        password = os.environ['ONOS_WEB_PASS'] if 'ONOS_WEB_PASS' in os.environ else 'rocks'
-        pm.add_password(None, url, user, password)
-        urllib2.install_opener(urllib2.build_opener(urllib2.HTTPBasicAuthHandler(pm)))
-        try:
-            # Push config data to controller
-            req = urllib2.Request(url, json.dumps(cfgData),
-                                  {'Content-Type': 'application/json'})
-            f = urllib2.urlopen(req)
-            print f.read()
-            f.close()
-        except urllib2.URLError as e:
-            warn("*** WARN: unable to push config to ONOS (%s)\n" % e.reason)
+        self.batcher(controllers).add(cfgData)
 
 if __name__ == "__main__":
     setLogLevel('info')
@@ -293,5 +291,6 @@ if __name__ == "__main__":
     net = get_mininet(arguments, topo, switch)
 
     net.start()
+    ONOSOVSSwitch.waitForNetcfg()
     CLI(net)
     net.stop()
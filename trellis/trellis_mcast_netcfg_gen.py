@@ -1,91 +1,101 @@
 #! /usr/bin/python
 
+"""
+Generates the netcfg of access devices with many hosts, as used by
+trellis_mcast.py.
+
+Group g is an access device (of:<g + 1>) with hostsPerGroup hosts, host h on
+port h + 1. Odd ports are in the group's IPv4 network and even ports in its
+IPv6 one. Hosts are laid out in rows of columns hosts from the group's
+origin, a row per degree of latitude southwards, for the GUI. The ports and
+hosts are generated lazily and written out an entry at a time on top of the
+fixed parts of the netcfg (the leaves and their hosts), so memory stays
+bounded however many hosts there are:
+
+    ./trellis_mcast_netcfg_gen.py --groups 100 --hosts-per-group 1000 -o netcfg.json
+"""
+
+from netcfglib import writeNetcfg
+from trellislib import get_mac_from_int
+from collections import OrderedDict
+from ipaddress import ip_address
+import itertools
 import json
 
-# It contains the fixed parts of the netcfg.
-# In this case, they are the ports of the leafs
-# hosts attached to the leafs. These are parts
-# that at the moment we don't need to scale
-netcfg = {}
+# Netcfg holding the parts that don't scale, the leaves and their hosts
+BASE_NETCFG = 'trellis_mcast_netcfg_gen.json'
 
-# Base latitude and longitude for access devices
-groups_cord = {
-  "0" : [36, -106],
-  "1" : [36, -110],
-  "2" : [36, -114],
-  "3" : [36, -118]
-}
+def defaultNetworks(groups):
+    """Returns (IPv4 gateway, IPv6 gateway, IPv4 VLAN, IPv6 VLAN) of each
+    group: 10.100.<g + 1>.254/24 and 2002::<g + 1>ff/120 (the group number
+    taking the bits above the last 8 of the IPv6 address, so 2002::1:ff for
+    group 256), on VLANs 100 + g and 200 + g (or further apart for over 100
+    groups)."""
+    stride = max(100, groups)
+    if 100 + stride + groups > 4095:
+        raise Exception('Too many groups for a VLAN each: %s' % groups)
+    return [('10.%d.%d.254/24' % (100 + (g + 1) / 256, (g + 1) % 256),
+             '%s/120' % (ip_address(u'2002::') + ((g + 1) << 8) + 0xff),
+             100 + g, 100 + stride + g)
+            for g in range(groups)]
 
-# Groups, host per groups and networks for each access device
-groups = 4
-hosts_per_group = 48
-networks = (("10.100.1.254/24", "2002::1ff/120", 100, 200), \
-  ("10.100.2.254/24", "2002::2ff/120", 101, 201), \
-  ("10.100.3.254/24", "2002::3ff/120", 102, 202), \
-  ("10.100.4.254/24", "2002::4ff/120", 103, 203), )
+def defaultOrigins(groups):
+    """Returns the latitude and longitude of the first host of each group,
+    the groups side by side 4 degrees apart."""
+    return [(36, -106 - 4 * g) for g in range(groups)]
 
 def generateDpid(device):
-  dpid = hex( int( device ) )[ 2: ]
-  return '0' * ( 16 - len( dpid ) ) + dpid
+    return '%016x' % device
+
+def portEntries(groups, hostsPerGroup, networks):
+    """Yields the port config of every host."""
+    for g in range(groups):
+        ipv4, ipv6, vlan4, vlan6 = networks[g]
+        # Every other port shares a config
+        configs = [{'interfaces': [{'ips': [ipv6], 'vlan-untagged': vlan6}]},
+                   {'interfaces': [{'ips': [ipv4], 'vlan-untagged': vlan4}]}]
+        dpid = generateDpid(g + 1)
+        for port in range(1, hostsPerGroup + 1):
+            yield 'of:%s/%s' % (dpid, port), configs[port % 2]
 
-# Generate ports config
-def generate_port_cfg(host, device, networks):
-  device_index = device + 1
-  port_index = host + 1
-  dpid = generateDpid(device_index)
-  dpid_port = 'of:%s/%s' %(dpid, port_index)
-  netcfg['ports'][dpid_port] = {}
-  interfaces = []
-  interface = {}
-  ips = []
-  network = ""
-  vlan = ""
-  if port_index % 2 == 0:
-    network = networks[1]
-    vlan = networks[3]
-  else:
-    network = networks[0]
-    vlan = networks[2]
-  ips.append(network)
-  interface['ips'] = ips
-  interface['vlan-untagged'] = vlan
-  interfaces.append(interface)
-  netcfg['ports'][dpid_port]["interfaces"] = interfaces
+def hostEntries(groups, hostsPerGroup, origins, columns=3):
+    """Yields the host config, i.e. name and coordinates, of every host."""
+    counter = 0
+    for g in range(groups):
+        latitude, longitude = origins[g]
+        for h in range(hostsPerGroup):
+            counter += 1
+            row, column = divmod(h, columns)
+            yield '%s/-1' % get_mac_from_int(counter), \
+                {'basic': {'name': 'acc%d' % counter,
+                           'latitude': float(latitude - row - 1),
+                           'longitude': float(longitude + column)}}
 
-# Generate hosts coordinate
-def generate_host_cfg(mac, index, layer, group, counter):
-  lat = groups_cord[str(group)][0] - layer
-  lon = index + groups_cord[str(group)][1]
-  name = "%s%d" %("acc", counter + 1)
-  data = {
-    "basic" : {}
-  }
-  data["basic"]["name"] = name
-  data["basic"]["latitude"] = float(lat)
-  data["basic"]["longitude"] = float(lon)
-  netcfg["hosts"]["%s/-1" % mac] = data
+def mcastNetcfg(base, groups=4, hostsPerGroup=48, networks=None, origins=None, columns=3):
+    """Returns the netcfg sections of the base netcfg with the generated
+    ports and hosts added, for writeNetcfg()."""
+    networks = networks or defaultNetworks(groups)
+    origins = origins or defaultOrigins(groups)
+    generated = {'ports': portEntries(groups, hostsPerGroup, networks),
+                 'hosts': hostEntries(groups, hostsPerGroup, origins, columns)}
 
-# Read initial netcfg from file
-with open('trellis_mcast_netcfg_gen.json') as json_file:
-    netcfg = json.load(json_file)
+    sections = [(section, itertools.chain(entries.items(), generated.pop(section, [])))
+                for section, entries in base.items()]
+    return sections + generated.items()
 
-# Main function
-counter = 0
-for g in range(0, groups):
-  index = 0
-  layer = 0
-  for h in range(0, hosts_per_group):
-    mac = hex(counter + 1)[2:]
-    mac = '0' * ( 12 - len( mac ) ) + mac
-    mac = ':'.join(s.encode('hex') for s in mac.decode('hex'))
-    index = counter % 3
-    if index == 0 :
-      layer = layer + 1
-    generate_port_cfg(h, g, networks[g])
-    generate_host_cfg(mac, index, layer, g, counter)
-    counter = counter + 1
+if __name__ == '__main__':
+    import argparse
+    from mininet.log import setLogLevel
 
-# Dump the netcfg on file
-with open('data.txt', 'w') as outfile:
-    json.dump(netcfg, outfile)
+    parser = argparse.ArgumentParser(description='Generates the netcfg of the access devices of trellis_mcast')
+    parser.add_argument('-g', '--groups', type=int, default=4, help='number of access devices')
+    parser.add_argument('-n', '--hosts-per-group', type=int, default=48, help='number of hosts of each access device')
+    parser.add_argument('--columns', type=int, default=3, help='hosts per row of the GUI layout')
+    parser.add_argument('-b', '--base', default=BASE_NETCFG, help='netcfg to add the access devices to')
+    parser.add_argument('-o', '--output', default='data.txt', help='netcfg file to write')
+    args = parser.parse_args()
 
+    setLogLevel('info')
+    with open(args.base) as f:
+        base = json.load(f, object_pairs_hook=OrderedDict)
+    writeNetcfg(mcastNetcfg(base, args.groups, args.hosts_per_group, columns=args.columns), args.output)
@@ -9,9 +9,11 @@ import time
 
 sys.path.append('..')
 from mininet.node import Host, RemoteController
-from routinglib import RoutedHost, RoutedHost6, Router
+from mininet.log import info, debug, warn
+from routinglib import RoutedHost, RoutedHost6, Router, disable_offload, writeConfigs
+from startuplib import ParallelMininet, DEFAULT_WORKERS, runParallel, percentile, processes, waitFor
+from templatelib import renderAll
 import argparse
-from mininet.net import Mininet
 
 class TaggedRoutedHost(RoutedHost):
     """Host that can be configured with multiple IP addresses."""
@@ -80,70 +82,79 @@ class DoubleTaggedRoutedHost(RoutedHost):
 class DhcpClient(Host):
     def __init__(self, name, *args, **kwargs):
         super(DhcpClient, self).__init__(name, **kwargs)
+        self.dhcpIntfs = []
         self.pidFile = '/run/dhclient-%s.pid' % self.name
         self.leaseFile = '/var/lib/dhcp/dhcpclient-%s.lease' % (self.name, )
 
     def config(self, **kwargs):
         super(DhcpClient, self).config(**kwargs)
         self.cmd('ip addr flush dev %s' % self.defaultIntf())
+        processes.register(self.pidFile, self)
         self.cmd('dhclient -q -4 -nw -pf %s -lf %s %s &' % (self.pidFile, self.leaseFile, self.defaultIntf()))
+        self.dhcpIntfs.append((self.defaultIntf().name, 4, time.time()))
 
         disable_offload(self, self.defaultIntf())
 
     def terminate(self, **kwargs):
-        self.cmd('kill -9 `cat %s`' % self.pidFile)
-        self.cmd('rm -rf %s' % self.pidFile)
+        processes.terminate([self.pidFile])
         super(DhcpClient, self).terminate()
 
 class Dhcp6Client(Host):
     def __init__(self, name, *args, **kwargs):
         super(Dhcp6Client, self).__init__(name, **kwargs)
+        self.dhcpIntfs = []
         self.pidFile = '/run/dhclient-%s.pid' % self.name
         self.leaseFile = '/var/lib/dhcp/dhcpclient6-%s.lease' % (self.name, )
         self.sleep = kwargs.get('sleep', 3)
+        self.dadLatency = None
 
     def config(self, **kwargs):
         super(Dhcp6Client, self).config(**kwargs)
         self.cmd('ip -4 addr flush dev %s' % self.defaultIntf())
-        time.sleep(self.sleep)
+        self.dadLatency = wait_for_dad(self, self.defaultIntf(), self.sleep)
+        processes.register(self.pidFile, self)
         self.cmd('dhclient -q -6 -nw -pf %s -lf %s %s &' % (self.pidFile, self.leaseFile, self.defaultIntf()))
+        self.dhcpIntfs.append((self.defaultIntf().name, 6, time.time()))
 
         disable_offload(self, self.defaultIntf())
 
     def terminate(self, **kwargs):
-        self.cmd('kill -9 `cat %s`' % self.pidFile)
-        self.cmd('rm -rf %s' % self.pidFile)
+        processes.terminate([self.pidFile])
         super(Dhcp6Client, self).terminate()
 
 # Client that has on the same interface (eth0) both IPv4 and IPv6 addresses
 class Dhcp4and6Client(Host):
     def __init__(self, name, *args, **kwargs):
         super(Dhcp4and6Client, self).__init__(name, **kwargs)
+        self.dhcpIntfs = []
         self.pidFile4 = '/run/dhclient-%s-4.pid' % self.name
         self.pidFile6 = '/run/dhclient-%s-6.pid' % self.name
         self.leaseFile4 = '/var/lib/dhcp/dhcpclient-%s.lease' % (self.name, )
         self.leaseFile6 = '/var/lib/dhcp/dhcpclient6-%s.lease' % (self.name, )
         self.sleep = kwargs.get('sleep', 3)
+        self.dadLatency = None
 
     def config(self, **kwargs):
         super(Dhcp4and6Client, self).config(**kwargs)
         self.cmd('ip addr flush dev %s' % self.defaultIntf())
+        processes.register(self.pidFile4, self)
         self.cmd('dhclient -q -4 -nw -pf %s -lf %s %s &' % (self.pidFile4, self.leaseFile4, self.defaultIntf()))
+        self.dhcpIntfs.append((self.defaultIntf().name, 4, time.time()))
 
         self.cmd('ip -4 addr flush dev %s' % self.defaultIntf())
-        time.sleep(self.sleep)
+        self.dadLatency = wait_for_dad(self, self.defaultIntf(), self.sleep)
+        processes.register(self.pidFile6, self)
         self.cmd('dhclient -q -6 -nw -pf %s -lf %s %s &' % (self.pidFile6, self.leaseFile6, self.defaultIntf()))
+        self.dhcpIntfs.append((self.defaultIntf().name, 6, time.time()))
 
         disable_offload(self, self.defaultIntf())
 
     def terminate(self, **kwargs):
-        self.cmd('kill -9 `cat %s`' % self.pidFile4)
-        self.cmd('rm -rf %s' % self.pidFile4)
-        self.cmd('kill -9 `cat %s`' % self.pidFile6)
-        self.cmd('rm -rf %s' % self.pidFile6)
+        processes.terminate([self.pidFile4, self.pidFile6])
         super(Dhcp4and6Client, self).terminate()
 
 class DhcpServer(RoutedHost):
+    configStage = 0
     binFile = '/usr/sbin/dhcpd'
     pidFile = '/run/dhcp-server-dhcpd.pid'
     configFile = './dhcpd.conf'
@@ -154,16 +165,17 @@ class DhcpServer(RoutedHost):
         if "configFile" in kwargs:
             self.configFile = kwargs['configFile']
         self.cmd('touch %s' % self.leasesFile)
+        processes.register(self.pidFile, self)
         self.cmd('%s -q -4 -pf %s -cf %s %s' % (self.binFile, self.pidFile, self.configFile, self.defaultIntf()))
 
         disable_offload(self, self.defaultIntf())
 
     def terminate(self, **kwargs):
-        self.cmd('kill -9 `cat %s`' % self.pidFile)
-        self.cmd('rm -rf %s' % self.pidFile)
+        processes.terminate([self.pidFile])
         super(DhcpServer, self).terminate()
 
 class Dhcp6Server(RoutedHost6):
+    configStage = 0
     binFile = '/usr/sbin/dhcpd'
     pidFile = '/run/dhcp-server-dhcpd6.pid'
     configFile = './dhcpd6.conf'
@@ -174,13 +186,13 @@ class Dhcp6Server(RoutedHost6):
         linkLocalAddr = mac_to_ipv6_linklocal(kwargs['mac'])
         self.cmd('ip -6 addr add dev %s scope link %s' % (self.defaultIntf(), linkLocalAddr))
         self.cmd('touch %s' % self.leasesFile)
+        processes.register(self.pidFile, self)
         self.cmd('%s -q -6 -pf %s -cf %s %s' % (self.binFile, self.pidFile, self.configFile, self.defaultIntf()))
 
         disable_offload(self, self.defaultIntf())
 
     def terminate(self, **kwargs):
-        self.cmd('kill -9 `cat %s`' % self.pidFile)
-        self.cmd('rm -rf %s' % self.pidFile)
+        processes.terminate([self.pidFile])
         self.cmd('rm -rf  %s' % self.leasesFile)
         super(Dhcp6Server, self).terminate()
 
@@ -199,18 +211,19 @@ class DhcpRelay(Router):
         super(DhcpRelay, self).config(**kwargs)
         ifacesStr = ' '.join(["-i " + ifaceName for ifaceName in self.interfaces.keys()])
         self.cmd('route add default gw %s' % self.gateway)
+        processes.register(self.pidFile, self)
         self.cmd('%s -4 -a -pf %s %s %s' % (self.binFile, self.pidFile, ifacesStr, self.serverIp))
 
-        disable_offload(self, ifacesStr)
+        disable_offload(self, self.interfaces.keys())
 
     def terminate(self, **kwargs):
-        self.cmd('kill -9 `cat %s`', self.pidFile)
-        self.cmd('rm -rf %s' % self.pidFile)
+        processes.terminate([self.pidFile])
         super(DhcpRelay, self).terminate()
 
 class TaggedDhcpClient(Host):
     def __init__(self, name, vlan, *args, **kwargs):
         super(TaggedDhcpClient, self).__init__(name, **kwargs)
+        self.dhcpIntfs = []
         self.pidFile = '/run/dhclient-%s.pid' % self.name
         self.vlan = vlan
         self.vlanIntf = None
@@ -221,35 +234,38 @@ class TaggedDhcpClient(Host):
         self.cmd('ip addr flush dev %s' % self.defaultIntf())
         self.cmd('ip link add link %s name %s type vlan id %s' % (self.defaultIntf(), self.vlanIntf, self.vlan))
         self.cmd('ip link set up %s' % self.vlanIntf)
+        processes.register(self.pidFile, self)
         self.cmd('dhclient -q -4 -nw -pf %s %s &' % (self.pidFile, self.vlanIntf))
+        self.dhcpIntfs.append((self.vlanIntf, 4, time.time()))
 
         disable_offload(self, self.vlanIntf)
 
     def terminate(self, **kwargs):
-        self.cmd('kill -9 `cat %s`' % self.pidFile)
-        self.cmd('rm -rf %s' % self.pidFile)
+        processes.terminate([self.pidFile])
         self.cmd('ip link remove link %s' % self.vlanIntf)
         super(TaggedDhcpClient, self).terminate()
 
 class TaggedDhcpServer(TaggedRoutedHost):
+    configStage = 0
     binFile = '/usr/sbin/dhcpd'
     pidFile = '/run/dhcp-server/dhcpd.pid'
     configFile = './dhcpd.conf'
 
     def config(self, **kwargs):
         super(TaggedDhcpServer, self).config(**kwargs)
+        processes.register(self.pidFile, self)
         self.cmd('%s -q -4 -pf %s -cf %s %s' % (self.binFile, self.pidFile, self.configFile, self.vlanIntf))
 
         disable_offload(self, self.vlanIntf)
 
     def terminate(self, **kwargs):
-        self.cmd('kill -9 `cat %s`' % self.pidFile)
-        self.cmd('rm -rf %s' % self.pidFile)
+        processes.terminate([self.pidFile])
         super(TaggedDhcpServer, self).terminate()
 
 class DualHomedDhcpClient(Host):
     def __init__(self, name, *args, **kwargs):
         super(DualHomedDhcpClient, self).__init__(name, **kwargs)
+        self.dhcpIntfs = []
         self.pidFile = '/run/dhclient-%s.pid' % self.name
         self.bond0 = None
 
@@ -267,20 +283,22 @@ class DualHomedDhcpClient(Host):
         self.cmd('ip addr flush dev %s' % intf0)
         self.cmd('ip addr flush dev %s' % intf1)
         self.cmd('ip link set %s up' % self.bond0)
+        processes.register(self.pidFile, self)
         self.cmd('dhclient -q -4 -nw -pf %s %s &' % (self.pidFile, self.bond0))
+        self.dhcpIntfs.append((self.bond0, 4, time.time()))
 
         disable_offload(self, self.bond0)
 
     def terminate(self, **kwargs):
         self.cmd('ip link set %s down' % self.bond0)
         self.cmd('ip link delete %s' % self.bond0)
-        self.cmd('kill -9 `cat %s`' % self.pidFile)
-        self.cmd('rm -rf %s' % self.pidFile)
+        processes.terminate([self.pidFile])
         super(DualHomedDhcpClient, self).terminate()
 
 class DualHomedLacpDhcpClient(Host):
     def __init__(self, name, *args, **kwargs):
         super(DualHomedLacpDhcpClient, self).__init__(name, **kwargs)
+        self.dhcpIntfs = []
         self.pidFile = '/run/dhclient-%s.pid' % self.name
         self.bond0 = None
 
@@ -298,25 +316,28 @@ class DualHomedLacpDhcpClient(Host):
         self.cmd('ip addr flush dev %s' % intf0)
         self.cmd('ip addr flush dev %s' % intf1)
         self.cmd('ip link set %s up' % self.bond0)
+        processes.register(self.pidFile, self)
         self.cmd('dhclient -q -4 -nw -pf %s %s' % (self.pidFile, self.bond0))
+        self.dhcpIntfs.append((self.bond0, 4, time.time()))
 
         disable_offload(self, self.bond0)
 
     def terminate(self, **kwargs):
         self.cmd('ip link set %s down' % self.bond0)
         self.cmd('ip link delete %s' % self.bond0)
-        self.cmd('kill -9 `cat %s`' % self.pidFile)
-        self.cmd('rm -rf %s' % self.pidFile)
+        processes.terminate([self.pidFile])
         super(DualHomedLacpDhcpClient, self).terminate()
 
 # Dual-homed Client that has both IPv4 and IPv6 addresses
 class DualHomedDhcp4and6Client(Host):
     def __init__(self, name, *args, **kwargs):
         super(DualHomedDhcp4and6Client, self).__init__(name, **kwargs)
+        self.dhcpIntfs = []
         self.pidFile4 = '/run/dhclient-%s-4.pid' % self.name
         self.pidFile6 = '/run/dhclient-%s-6.pid' % self.name
         self.bond0 = None
         self.sleep = kwargs.get('sleep', 3)
+        self.dadLatency = None
 
     def config(self, **kwargs):
         super(DualHomedDhcp4and6Client, self).config(**kwargs)
@@ -333,20 +354,21 @@ class DualHomedDhcp4and6Client(Host):
         self.cmd('ip -4 addr flush dev %s' % intf1)
         self.cmd('ip addr flush dev %s' % intf0)
         self.cmd('ip addr flush dev %s' % intf1)
-        time.sleep(self.sleep)
         self.cmd('ip link set %s up' % self.bond0)
+        processes.register(self.pidFile4, self)
         self.cmd('dhclient -q -4 -nw -pf %s %s &' % (self.pidFile4, self.bond0))
+        self.dhcpIntfs.append((self.bond0, 4, time.time()))
+        self.dadLatency = wait_for_dad(self, self.bond0, self.sleep)
+        processes.register(self.pidFile6, self)
         self.cmd('dhclient -q -6 -nw -pf %s %s &' % (self.pidFile6, self.bond0))
+        self.dhcpIntfs.append((self.bond0, 6, time.time()))
 
         disable_offload(self, self.bond0)
 
     def terminate(self, **kwargs):
         self.cmd('ip link set %s down' % self.bond0)
         self.cmd('ip link delete %s' % self.bond0)
-        self.cmd('kill -9 `cat %s`' % self.pidFile4)
-        self.cmd('kill -9 `cat %s`' % self.pidFile6)
-        self.cmd('rm -rf %s' % self.pidFile4)
-        self.cmd('rm -rf %s' % self.pidFile6)
+        processes.terminate([self.pidFile4, self.pidFile6])
         super(DualHomedDhcp4and6Client, self).terminate()
 
 # Utility for IPv6
@@ -367,11 +389,85 @@ def mac_to_ipv6_linklocal(mac):
 
     return 'fe80::{:04x}:{:02x}ff:fe{:02x}:{:04x}'.format(high2, high1, low1, low2)
 
+# Waits for IPv6 duplicate address detection to finish on an interface,
+# i.e. until it has a link-local address that is no longer tentative.
+# Returns the time waited in seconds, or None if DAD didn't finish within
+# the timeout.
+def wait_for_dad(host, intf, timeout=3):
+    def dad_finished():
+        output = host.cmd('ip -6 addr show dev %s scope link' % intf)
+        return 'inet6' in output and 'tentative' not in output
+
+    latency = waitFor(dad_finished, timeout)
+    if latency is None:
+        warn('*** %s: DAD on %s not finished after %ss\n' % (host.name, intf, timeout))
+    else:
+        debug('*** %s: DAD on %s finished after %.3fs\n' % (host.name, intf, latency))
+    return latency
+
+# Gets the measured DAD latency of every host that waits for DAD
+def get_dad_latencies(net):
+    return dict((host.name, host.dadLatency) for host in net.hosts
+                if hasattr(host, 'dadLatency'))
+
+# Checks whether a DHCP client has been given an address on an interface.
+# dhclient installs DHCPv6 addresses as /128s, which tells them apart from
+# addresses autoconfigured from router advertisements.
+def has_lease(host, intf, version):
+    output = host.cmd('ip -%s addr show dev %s scope global' % (version, intf))
+    for line in output.splitlines():
+        words = line.split()
+        if not words or 'tentative' in words:
+            continue
+        if version == 4 and words[0] == 'inet':
+            return True
+        if version == 6 and words[0] == 'inet6' and words[1].endswith('/128'):
+            return True
+    return False
+
+# Waits until every DHCP client in the network has been addressed. The clients
+# are polled concurrently and the time from starting dhclient to getting
+# an address is returned per host (None for hosts that timed out).
+def wait_for_leases(net, timeout=60, maxWorkers=64):
+    clients = [host for host in net.hosts if getattr(host, 'dhcpIntfs', None)]
+    deadline = time.time() + timeout
+
+    def wait_for_host(host):
+        latency = 0
+        for intf, version, started in host.dhcpIntfs:
+            if waitFor(lambda: has_lease(host, intf, version),
+                       max(deadline - time.time(), 0)) is None:
+                warn('*** %s: no DHCPv%s lease on %s after %ss\n' % (host.name, version, intf, timeout))
+                return None
+            latency = max(latency, time.time() - started)
+        return latency
+
+    results = runParallel(wait_for_host, clients, maxWorkers)
+    latencies = dict((host.name, latency) for host, (latency, _) in results.items())
+    print_lease_report(latencies)
+    return latencies
+
+# Prints a time-to-lease histogram and percentiles
+def print_lease_report(latencies):
+    leased = [latency for latency in latencies.values() if latency is not None]
+    info('*** %d/%d DHCP clients addressed\n' % (len(leased), len(latencies)))
+    if not leased:
+        return
+
+    buckets = [0.5, 1, 2, 4, 8, 16, 32, 64]
+    counts = [0] * (len(buckets) + 1)
+    for latency in leased:
+        counts[len([b for b in buckets if b < latency])] += 1
+    for i, count in enumerate(counts):
+        label = '<= %ss' % buckets[i] if i < len(buckets) else '> %ss' % buckets[-1]
+        info('%8s %5d %s\n' % (label, count, '#' * (count * 50 / len(leased))))
+
+    info('*** Time to lease: p50 %.2fs p99 %.2fs max %.2fs\n'
+         % (percentile(leased, 50), percentile(leased, 99), max(leased)))
+
 def get_mac_from_int(number):
-    mac = hex(number)[2:]
-    mac = '0' * ( 12 - len( mac ) ) + mac
-    mac = ':'.join(s.encode('hex') for s in mac.decode('hex'))
-    return mac
+    mac = '%012x' % number
+    return ':'.join(mac[i:i + 2] for i in range(0, 12, 2))
 
 # Parses Trellis parameters
 def parse_trellis_args():
@@ -380,11 +476,36 @@ def parse_trellis_args():
                         required = True, default = "")
     parser.add_argument("-a", "--aggregation", help = "number of aggregation switches (1-4)",
                         required = False, default = 1)
+    parser.add_argument("-j", "--jobs", help = "number of nodes to configure in parallel",
+                        required = False, type = int, default = DEFAULT_WORKERS)
+    parser.add_argument("-l", "--wait-leases",
+                        help = "once started, wait up to this many seconds for the DHCP clients' leases",
+                        required = False, type = float, default = None)
+    parser.add_argument("-t", "--trace", help = "write a start-up profile trace to this file",
+                        required = False, default = None)
     return parser.parse_args()
 
 # Gets a mininet instance
+class TrellisMininet(ParallelMininet):
+
+    """ParallelMininet that, given a leaseTimeout, waits for its DHCP clients
+    to be addressed once started (see wait_for_leases)."""
+
+    def __init__(self, *args, **kwargs):
+        self.leaseTimeout = kwargs.pop('leaseTimeout', None)
+        super(TrellisMininet, self).__init__(*args, **kwargs)
+
+    def start(self):
+        super(TrellisMininet, self).start()
+        if self.leaseTimeout:
+            wait_for_leases(self, self.leaseTimeout)
+
 def get_mininet(arguments, topo, switch):
-    net = Mininet(topo=topo, controller=None, switch=switch)
+    jobs = getattr(arguments, 'jobs', DEFAULT_WORKERS)
+    trace = getattr(arguments, 'trace', None)
+    leases = getattr(arguments, 'wait_leases', None)
+    net = TrellisMininet(topo=topo, controller=None, switch=switch, maxWorkers=jobs,
+                         traceFile=trace, leaseTimeout=leases)
 
     if arguments.controllers:
         controllers = arguments.controllers.split(',')
@@ -396,15 +517,6 @@ def get_mininet(arguments, topo, switch):
 
 # Generates the Zebra config files
 def set_up_zebra_config(controllers_string):
-    zebra_config = "log file /var/log/quagga/zebradbgp{}.log\n" \
-                   "hostname zebra-bgp{}\n" \
-                   "password quagga\n" \
-                    "!\n" \
-                    "! Default route via virtual management switch\n" \
-                    "!\n" \
-                    "ip route 0.0.0.0/0 172.16.0.1\n" \
-                    "!\n" \
-                    "fpm connection ip {} port 2620\n"
     controllers = controllers_string.split(',')
 
     controller1 = controllers[0]
@@ -413,19 +525,15 @@ def set_up_zebra_config(controllers_string):
     else:
         controller2 = controller1
 
-
-    zebra1 = zebra_config.format("1", "1", controller1)
-    zebra2 = zebra_config.format("2", "2", controller2)
-
-    with open("zebradbgp1.conf", "w") as config_file_1:
-        config_file_1.write(zebra1)
-
-    with open("zebradbgp2.conf", "w") as config_file_2:
-        config_file_2.write(zebra2)
-
-# Disable NIC offloading
-def disable_offload(host, intf):
-    for attr in ["rx", "tx", "sg"]:
-        cmd = "/sbin/ethtool --offload %s %s off" % (intf, attr)
-        host.cmd(cmd)
+    jobs = []
+    for name, controller in [("bgp1", controller1), ("bgp2", controller2)]:
+        values = {'name': name,
+                  'logDir': '/var/log/quagga',
+                  'password': 'quagga',
+                  # Default route via virtual management switch
+                  'staticRoutes': ['0.0.0.0/0 172.16.0.1'],
+                  'fpm': controller}
+        jobs.append(("zebrad%s.conf" % name, 'zebra', values))
+
+    writeConfigs(renderAll(jobs))
 